@@ -0,0 +1,198 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import numpy as np
+from catalog_version import CATALOG_VERSION_PATH, read_catalog_version
+
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache.sqlite3")
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+
+# Words that make a question depend on the previous answer
+_FOLLOW_UP_RE = re.compile(
+    r"\b(it|its|it's|that|those|these|them|they|this one|the first|the second|the last|"
+    r"the same|above|previous|more about|tell me more|which one|compare|instead|also)\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_query(query):
+    """Normalize a query for exact-match lookups."""
+    text = query.lower().replace("what's", "what is").replace("whats", "what is")
+    text = re.sub(r"[^\w$.\s]", " ", text)
+    text = re.sub(r"(?<!\d)\.|\.(?!\d)", " ", text)
+    return " ".join(text.split())
+
+
+def is_follow_up(query, previous_answer):
+    """True if the query likely refers back to the previous answer."""
+    return bool(previous_answer) and bool(_FOLLOW_UP_RE.search(query))
+
+
+def filter_key(filter_dict):
+    """Canonical text for a metadata filter, so equal filters compare equal."""
+    return json.dumps(filter_dict, sort_keys=True) if filter_dict else ""
+
+
+class AnswerCache:
+    """Persistent answer cache matched on normalized text, then on embedding similarity.
+
+    A semantic match also needs the same metadata filter, so questions that
+    differ only in a price or brand ("under $20" / "under $30") don't share
+    answers. Entries are evicted least-recently-used beyond max_entries and
+    expire after ttl seconds. The whole cache is dropped when ingest.py
+    publishes a new catalog version.
+    """
+
+    def __init__(self, path=ANSWER_CACHE_PATH, threshold=ANSWER_CACHE_THRESHOLD,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl=ANSWER_CACHE_TTL,
+                 version_path=CATALOG_VERSION_PATH):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_path = version_path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(answers)")]
+        if columns and "filter" not in columns:
+            # Entries from before filters were stored can't be matched safely
+            self.db.execute("DROP TABLE answers")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "query TEXT PRIMARY KEY, embedding BLOB, answer TEXT, contexts TEXT, "
+            "created REAL, last_used REAL, filter TEXT)"
+        )
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+        self._version_mtime = None
+        self._check_version()
+        self._load_embeddings()
+
+    def _load_embeddings(self):
+        rows = self.db.execute(
+            "SELECT query, embedding, filter FROM answers WHERE embedding IS NOT NULL"
+        ).fetchall()
+        self._keys = [query for query, _, _ in rows]
+        self._filters = [stored_filter or "" for _, _, stored_filter in rows]
+        self._matrix = (
+            np.vstack([np.frombuffer(blob, dtype=np.float32) for _, blob, _ in rows])
+            if rows else None
+        )
+
+    def _check_version(self):
+        """Clear the cache if the published catalog version changed."""
+        try:
+            mtime = os.path.getmtime(self.version_path)
+        except OSError:
+            mtime = None
+        if mtime == self._version_mtime:
+            return
+        self._version_mtime = mtime
+        version = read_catalog_version(self.version_path) or ""
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'catalog_version'").fetchone()
+        if row is None or row[0] != version:
+            self.db.execute("DELETE FROM answers")
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('catalog_version', ?)", (version,))
+            self.db.commit()
+            self._keys, self._filters, self._matrix = [], [], None
+
+    def _hit(self, key, now):
+        row = self.db.execute(
+            "SELECT answer, contexts, created FROM answers WHERE query = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[2] > self.ttl:
+            self._delete([key])
+            return None
+        self.db.execute("UPDATE answers SET last_used = ? WHERE query = ?", (now, key))
+        self.db.commit()
+        return {"answer": row[0], "contexts": json.loads(row[1])}
+
+    def _forget(self, keys):
+        """Drop keys from the in-memory embedding matrix."""
+        keys = set(keys)
+        keep = [pos for pos, key in enumerate(self._keys) if key not in keys]
+        if len(keep) == len(self._keys):
+            return
+        self._keys = [self._keys[pos] for pos in keep]
+        self._filters = [self._filters[pos] for pos in keep]
+        self._matrix = self._matrix[keep] if keep else None
+
+    def _delete(self, keys):
+        self.db.executemany("DELETE FROM answers WHERE query = ?", [(key,) for key in keys])
+        self.db.commit()
+        self._forget(keys)
+
+    def _evict(self, now):
+        """Drop expired entries, then the least recently used beyond max_entries."""
+        cutoff = now - self.ttl
+        stale = [key for (key,) in self.db.execute("SELECT query FROM answers WHERE created < ?", (cutoff,))]
+        (count,) = self.db.execute("SELECT COUNT(*) FROM answers").fetchone()
+        excess = count - len(stale) - self.max_entries
+        if excess > 0:
+            stale += [key for (key,) in self.db.execute(
+                "SELECT query FROM answers WHERE created >= ? ORDER BY last_used, rowid LIMIT ?", (cutoff, excess)
+            )]
+        if stale:
+            self._delete(stale)
+
+    def get(self, query, embedding=None, filter_dict=None):
+        """Return {"answer", "contexts"} for a cached query, or None.
+
+        Without an embedding only the exact (normalized) lookup is tried. A
+        semantic match must have been stored with the same filter_dict.
+        """
+        with self.lock:
+            self._check_version()
+            now = time.time()
+            key = normalize_query(query)
+            hit = self._hit(key, now)
+            if hit is not None or embedding is None or self._matrix is None:
+                return hit
+
+            vector = np.asarray(embedding, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+            if vector.shape[0] != self._matrix.shape[1]:
+                return None
+            scores = self._matrix @ vector
+            scores[np.asarray(self._filters) != filter_key(filter_dict)] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            return self._hit(self._keys[best], now)
+
+    def put(self, query, embedding, answer, contexts, filter_dict=None):
+        with self.lock:
+            self._check_version()
+            now = time.time()
+            key = normalize_query(query)
+            vector = None
+            if embedding is not None:
+                vector = np.asarray(embedding, dtype=np.float32)
+                vector = vector / (np.linalg.norm(vector) or 1.0)
+                if self._matrix is not None and vector.shape[0] != self._matrix.shape[1]:
+                    vector = None
+            self.db.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, None if vector is None else vector.tobytes(), answer,
+                 json.dumps(contexts, ensure_ascii=False), now, now, filter_key(filter_dict)),
+            )
+            self.db.commit()
+            # Keep the in-memory matrix in step: replace or append this one row
+            self._forget([key])
+            if vector is not None:
+                self._keys.append(key)
+                self._filters.append(filter_key(filter_dict))
+                self._matrix = vector[None, :] if self._matrix is None else np.vstack([self._matrix, vector])
+            self._evict(now)
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM answers")
+            self.db.commit()
+            self._keys, self._filters, self._matrix = [], [], None
@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import threading
+import argparse
+import platform
+import tempfile
+import numpy as np
+from fake_services import Faults, start_fake_openai, start_fake_pinecone, server_url
+import catalog_store
+import telemetry
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_QUERIES = [
+    "Show me cheeses under $20",
+    "What is the most expensive cheese?",
+    "Cheeses by Galbani",
+    "mozzarella under 5 pounds",
+    "shredded cheddar cheese",
+    "How many feta cheeses do you have?",
+    "sliced provolone for sandwiches",
+    "parmesan between $30 and $60",
+    "What cheese goes well with red wine?",
+    "cream cheese sold by the case",
+    "SKU 103674",
+    "cheapest cheese per pound",
+]
+
+
+def percentiles(samples):
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process, or None where it is not available."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def write_catalog(source, path, scale):
+    """Copy the catalog, repeating it `scale` times under new SKUs to simulate larger catalogs."""
+    with open(source, "r", encoding="utf-8") as f:
+        products = json.load(f)
+    scaled = []
+    for copy in range(scale):
+        for product in products:
+            if copy:
+                product = dict(product, SKU=int(product["SKU"]) * 1000 + copy,
+                               UPC=int(product["SKU"]) * 1000 + copy,
+                               product_name=f"{product['product_name']} #{copy}")
+            scaled.append(product)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(scaled, f, ensure_ascii=False)
+    return len(scaled)
+
+
+class Timer:
+    """Collects per-stage latencies and failures."""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def run(self, stage, fn):
+        started = time.perf_counter()
+        try:
+            return fn()
+        except Exception as e:
+            self.errors.setdefault(stage, []).append(f"{type(e).__name__}: {e}")
+            return None
+        finally:
+            self.samples.setdefault(stage, []).append(time.perf_counter() - started)
+
+    def report(self):
+        return {
+            stage: dict(percentiles(samples), errors=len(self.errors.get(stage, [])))
+            for stage, samples in self.samples.items()
+        }
+
+
+def run_ingest(timer, product_count):
+    import ingest
+    started = time.perf_counter()
+    timer.run("ingest", lambda: ingest.ingest(full_rebuild=True))
+    seconds = time.perf_counter() - started
+    return {
+        "products": product_count,
+        "seconds": round(seconds, 3),
+        "products_per_sec": round(product_count / seconds, 1) if seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_queries(timer, queries, repeat, quantization="none"):
+    # The engine runs on one background loop, as it does under chatbot.py
+    from engine import ChatEngine
+    from context_builder import build_context
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True, name="benchmark-loop").start()
+
+    def run_async(coro):
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+    started = time.perf_counter()
+    # Passed explicitly: local_index read LOCAL_INDEX_QUANTIZATION when fake_services imported it
+    engine = ChatEngine(quantization=quantization)
+    startup = time.perf_counter() - started
+    tier = getattr(engine.index, "quantization", None)
+
+    for _ in range(repeat):
+        for query in queries:
+            embedding = timer.run("embed_text", lambda: run_async(engine.embed_text(query)))
+            filter_dict = timer.run("get_filter", lambda: run_async(engine.get_filter(query)))
+            contexts = None
+            if embedding is not None:
+                contexts = timer.run("vector_query", lambda: run_async(
+                    engine.query_index(embedding, filter_dict, 5)))
+            if contexts:
+                context, _, _ = build_context(contexts)
+                timer.run("ask_gpt", lambda: run_async(engine.ask_gpt(query, context, "")))
+            timer.run("turn", lambda: run_async(engine.answer_turn(query, "")))
+    return {"startup_seconds": round(startup, 3), "peak_rss_mb": peak_rss_mb(), "index_tier": tier}
+
+
+def compare(results, baseline_path):
+    """Print p50/p95 changes against an earlier results file."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nChange vs {baseline_path}:")
+    for stage, stats in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before or not stats.get("count") or not before.get("count"):
+            continue
+        deltas = []
+        for key in ("p50_ms", "p95_ms"):
+            change = (stats[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            deltas.append(f"{key} {before[key]:.1f} -> {stats[key]:.1f} ({change:+.0f}%)")
+        print(f"  {stage:<13} " + ", ".join(deltas))
+    if "ingest" in results and "ingest" in baseline:
+        print(f"  ingest        {baseline['ingest']['products_per_sec']} -> "
+              f"{results['ingest']['products_per_sec']} products/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingest and chat turns against local fake OpenAI/Pinecone")
+    parser.add_argument("--backend", choices=["pinecone", "local"], default="pinecone")
+    parser.add_argument("--catalog", default=os.path.join(REPO_DIR, "cheese_data.json"))
+    parser.add_argument("--scale", type=int, default=1, help="Repeat the catalog this many times")
+    parser.add_argument("--catalog-format", choices=["arrow", "json"], default="arrow",
+                        help="Catalog file ingest and structured queries read")
+    parser.add_argument("--queries", help="Text file with one query per line (default: built-in corpus)")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over the query corpus")
+    parser.add_argument("--latency", type=float, default=0.05, help="Base seconds per upstream request")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Uniform +/- seconds on each request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 429/503")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Seconds between streamed chunks")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the answer cache enabled")
+    parser.add_argument("--quantization", choices=["none", "int8", "binary"], default="none",
+                        help="Compressed search tier for the local backend; also reports recall@5")
+    parser.add_argument("--skip-ingest", action="store_true",
+                        help="Reuse the index already in --workdir (local backend only)")
+    parser.add_argument("--workdir", help="Directory for generated indexes and caches (default: a temp dir)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    faults = Faults(args.latency, args.jitter, args.error_rate, args.token_latency, seed=args.seed)
+    openai_server = start_fake_openai(faults)
+    pinecone_server = start_fake_pinecone(faults)
+
+    # Everything ingest.py and the engine write goes to the work dir, never the repo
+    workdir = args.workdir or tempfile.mkdtemp(prefix="cheese-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    product_count = write_catalog(args.catalog, os.path.join(workdir, "cheese_data.json"), args.scale)
+    os.chdir(workdir)
+    if args.catalog_format == "arrow":
+        catalog_store.import_json()
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": f"{server_url(openai_server)}/v1",
+        "PINECONE_API_KEY": "benchmark",
+        "PINECONE_HOST": server_url(pinecone_server),
+        "VECTOR_BACKEND": args.backend,
+        "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false",
+        "LOCAL_INDEX_QUANTIZATION": args.quantization,
+    })
+
+    timer = Timer()
+    results = {
+        "config": dict(vars(args), queries=len(queries), products=product_count,
+                       python=platform.python_version(), platform=platform.platform()),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    results["catalog"] = [catalog_store.describe(path) for path in ("cheese_data.json", "cheese_data.arrow")
+                          if os.path.exists(path)]
+    if not args.skip_ingest:
+        results["ingest"] = run_ingest(timer, product_count)
+    results["chat"] = run_queries(timer, queries, args.repeat, args.quantization)
+    if args.backend == "local" and args.quantization != "none":
+        from local_index import recall_report
+        results["recall"] = recall_report(mode=args.quantization, k=5)
+    results["stages"] = timer.report()
+    results["upstream"] = {"requests": faults.requests, "injected_errors": faults.errors}
+    results["counters"] = telemetry.metrics.snapshot()["counters"]
+    results["sample_errors"] = {stage: errors[:3] for stage, errors in timer.errors.items()}
+
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n{'stage':<13} {'n':>5} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for stage, stats in results["stages"].items():
+        if stats["count"]:
+            print(f"{stage:<13} {stats['count']:>5} {stats['errors']:>4} "
+                  f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f}")
+    for catalog in results["catalog"]:
+        print(f"catalog {catalog['path']}: {catalog['file_bytes'] / 1024:.0f} KB, open {catalog['open_ms']:.1f} ms")
+    if "ingest" in results:
+        print(f"ingest: {results['ingest']['products_per_sec']} products/sec")
+    tier = results["chat"]["index_tier"]
+    print(f"chat measured on: {args.backend} index" + (f", {tier} tier" if tier else ""))
+    if "recall" in results:
+        recall = results["recall"]
+        print(f"{recall['mode']}: recall@5 {recall['recall_reranked']} (codes only {recall['recall_coarse']}), "
+              f"{recall['bytes_per_vector_quantized']} bytes/product ({recall['compression']}x smaller)")
+    print(f"peak RSS: {peak_rss_mb()} MB · results written to {output}")
+    if baseline:
+        compare(results, baseline)
+
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import re
+import json
+import numpy as np
+import pandas as pd
+from query_parser import QueryParser
+from catalog_store import CatalogRecords, read_table
+
+NUMERIC_FIELDS = ["price", "Cost per pound", "weight(pound)"]
+
+_NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+                 "seven": 7, "eight": 8, "nine": 9, "ten": 10}
+_N = r"(\d+|one|two|three|four|five|six|seven|eight|nine|ten)"
+_TOP_N_RE = re.compile(
+    r"\b(?:top|first)\s+" + _N + r"\b|\b" + _N +
+    r"\s+(?:cheapest|most|least|priciest|lightest|heaviest|lowest|highest|best|largest|smallest|biggest)\b",
+    re.IGNORECASE,
+)
+_PLURAL_RE = re.compile(r"\b(cheeses|products|options|ones|items)\b", re.IGNORECASE)
+_PER_POUND_RE = re.compile(r"\b(per pound|per lb|/lb|a pound|cost per pound|price per pound|unit price)\b", re.IGNORECASE)
+
+_LOW_PRICE_RE = re.compile(r"\b(cheapest|least expensive|lowest[- ]priced|lowest price|most affordable|best value|best deal)\b", re.IGNORECASE)
+_HIGH_PRICE_RE = re.compile(r"\b(most expensive|priciest|highest[- ]priced|highest price|costliest)\b", re.IGNORECASE)
+_LIGHT_RE = re.compile(r"\b(lightest|smallest)\b", re.IGNORECASE)
+_HEAVY_RE = re.compile(r"\b(heaviest|largest|biggest)\b", re.IGNORECASE)
+# Counting and averaging need something countable/averageable next to the trigger word,
+# so "how many calories" or "typical flavor" go to retrieval instead
+_COUNT_RE = re.compile(
+    r"\b(?:how many|number of|count of|total)\s+(?:[\w-]+\s+){0,3}?"
+    r"(?:cheeses|products?|items?|options|brands?|companies|skus?|kinds|types|varieties)\b",
+    re.IGNORECASE,
+)
+_AVERAGE_RE = re.compile(
+    r"\b(?:average|mean|typical)\s+(?:[\w-]+\s+){0,2}?(?:prices?|costs?|weights?|price per pound|cost per pound)\b"
+    r"|\b(?:prices?|costs?|weights?)\b.*\bon average\b",
+    re.IGNORECASE,
+)
+_RANGE_RE = re.compile(r"\b(price range|range of prices|min and max|minimum and maximum)\b", re.IGNORECASE)
+_BRAND_GROUP_RE = re.compile(r"\b(by brand|per brand|each brand|every brand|which brands?|what brands?|by company|per company)\b", re.IGNORECASE)
+_WEIGHT_WORD_RE = re.compile(r"\b(weight|weigh|weighs|heavy|pounds)\b", re.IGNORECASE)
+
+_STOPWORDS = {"cheese", "cheeses", "the", "and", "with", "what", "which", "show", "how",
+              "many", "most", "least", "for", "are", "you", "have", "product", "products"}
+
+
+def _money(value):
+    return f"${value:,.2f}"
+
+
+class CatalogQuery:
+    """Exact answers to aggregate and superlative questions over a columnar catalog.
+
+    The catalog is loaded once into a DataFrame with numeric columns and
+    precomputed ascending sort orders for price, Cost per pound and weight.
+    answer() returns None when the question is not an aggregate/superlative
+    one, so the caller can fall back to vector search.
+    """
+
+    def __init__(self, products):
+        if isinstance(products, CatalogRecords):
+            # Columns come straight from the Arrow table; row dicts are built on demand
+            self.products = products
+            frame = products.table.to_pandas()
+        else:
+            self.products = list(products)
+            frame = pd.DataFrame(self.products)
+        for field in NUMERIC_FIELDS:
+            frame[field] = pd.to_numeric(frame.get(field), errors="coerce")
+        self.frame = frame
+        self.names = frame["product_name"].fillna("").str.lower().to_numpy().astype(str)
+        self.companies = frame["company_name"].fillna("").to_numpy()
+        # NaNs sort last, so they never win a superlative
+        self.sort_orders = {
+            field: np.argsort(frame[field].to_numpy(), kind="stable") for field in NUMERIC_FIELDS
+        }
+        self.vocabulary = {
+            word for name in self.names for word in re.findall(r"[a-z]+", name)
+            if len(word) > 2 and word not in _STOPWORDS
+        }
+        self.parser = QueryParser(c for c in self.companies if c)
+
+    @classmethod
+    def from_catalog(cls, path=None):
+        return cls(CatalogRecords(read_table(path)))
+
+    def _filter_mask(self, filter_dict):
+        mask = np.ones(len(self.frame), dtype=bool)
+        if not filter_dict:
+            return mask
+        for key, condition in filter_dict.items():
+            if key == "$and":
+                for sub in condition:
+                    mask &= self._filter_mask(sub)
+                continue
+            if key == "$or":
+                any_mask = np.zeros(len(self.frame), dtype=bool)
+                for sub in condition:
+                    any_mask |= self._filter_mask(sub)
+                mask &= any_mask
+                continue
+            if key not in self.frame:
+                return np.zeros(len(self.frame), dtype=bool)
+            column = self.frame[key]
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, value in condition.items():
+                if op == "$eq":
+                    mask &= (column == value).to_numpy()
+                elif op == "$ne":
+                    mask &= (column != value).to_numpy()
+                elif op == "$lt":
+                    mask &= (column < value).to_numpy()
+                elif op == "$lte":
+                    mask &= (column <= value).to_numpy()
+                elif op == "$gt":
+                    mask &= (column > value).to_numpy()
+                elif op == "$gte":
+                    mask &= (column >= value).to_numpy()
+                elif op == "$in":
+                    mask &= column.isin(value).to_numpy()
+                elif op == "$nin":
+                    mask &= ~column.isin(value).to_numpy()
+        return mask
+
+    def _keyword_mask(self, query):
+        """Restrict to products whose names contain the cheese words in the query.
+
+        Brands, amounts and units the parser turned into filters are not
+        name keywords, so they are left out.
+        """
+        query = self.parser.strip_matched(query)
+        words = [w for w in re.findall(r"[a-z]+", query.lower()) if w in self.vocabulary]
+        if not words:
+            return np.ones(len(self.frame), dtype=bool), words
+        all_mask = np.ones(len(self.frame), dtype=bool)
+        for word in words:
+            all_mask &= np.char.find(self.names, word) >= 0
+        if all_mask.any():
+            return all_mask, words
+        any_mask = np.zeros(len(self.frame), dtype=bool)
+        for word in words:
+            any_mask |= np.char.find(self.names, word) >= 0
+        return any_mask, words
+
+    @staticmethod
+    def _top_n(query):
+        match = _TOP_N_RE.search(query)
+        if match:
+            token = (match.group(1) or match.group(2)).lower()
+            return int(token) if token.isdigit() else _NUMBER_WORDS[token]
+        return 5 if _PLURAL_RE.search(query) else 1
+
+    def _superlative(self, query):
+        per_pound = bool(_PER_POUND_RE.search(query))
+        if _LOW_PRICE_RE.search(query):
+            return ("Cost per pound" if per_pound else "price"), False
+        if _HIGH_PRICE_RE.search(query):
+            return ("Cost per pound" if per_pound else "price"), True
+        if _LIGHT_RE.search(query):
+            return "weight(pound)", False
+        if _HEAVY_RE.search(query):
+            return "weight(pound)", True
+        return None, None
+
+    def answer(self, query):
+        """Return {"intent", "rows", "summary"} for aggregate questions, else None."""
+        sort_field, descending = self._superlative(query)
+        counting = bool(_COUNT_RE.search(query))
+        averaging = bool(_AVERAGE_RE.search(query))
+        ranging = bool(_RANGE_RE.search(query))
+        grouping = bool(_BRAND_GROUP_RE.search(query))
+        if not (sort_field or counting or averaging or ranging or grouping):
+            return None
+
+        filter_dict, _ = self.parser.parse(query, superlatives=False)
+        keyword_mask, words = self._keyword_mask(query)
+        mask = self._filter_mask(filter_dict) & keyword_mask
+        subset = self.frame[mask]
+        scope = " ".join(words) or "cheese"
+        if filter_dict:
+            scope += f" matching {json.dumps(filter_dict)}"
+
+        if grouping and not sort_field:
+            groups = (
+                subset.groupby("company_name")
+                .agg(products=("product_name", "count"), average_price=("price", "mean"),
+                     min_price=("price", "min"), max_price=("price", "max"))
+                .sort_values("products", ascending=False)
+            )
+            lines = [
+                f"- {brand}: {int(row.products)} products, average {_money(row.average_price)}, "
+                f"range {_money(row.min_price)}-{_money(row.max_price)}"
+                for brand, row in groups.iterrows()
+            ]
+            # One representative (cheapest) row per brand keeps the context small
+            rows = [self._row(subset[subset["company_name"] == brand]["price"].idxmin())
+                    for brand in groups.index[:10]]
+            return {"intent": "group_by_brand", "rows": rows,
+                    "summary": f"{len(groups)} brands for {scope}:\n" + "\n".join(lines)}
+
+        if counting:
+            rows = [self._row(i) for i in subset.index[:10]]
+            return {"intent": "count", "rows": rows,
+                    "summary": f"Exactly {len(subset)} products for {scope}."}
+
+        if averaging or ranging:
+            field = "Cost per pound" if _PER_POUND_RE.search(query) else (
+                "weight(pound)" if _WEIGHT_WORD_RE.search(query) else "price")
+            values = subset[field].dropna()
+            if values.empty:
+                return {"intent": "aggregate", "rows": [], "summary": f"No products for {scope}."}
+            fmt = (lambda v: f"{v:,.2f} lb") if field == "weight(pound)" else _money
+            rows = [self._row(values.idxmin()), self._row(values.idxmax())]
+            summary = (f"Across {len(values)} products for {scope}: {field} average {fmt(values.mean())}, "
+                       f"min {fmt(values.min())}, max {fmt(values.max())}.")
+            return {"intent": "aggregate", "rows": rows, "summary": summary}
+
+        # Top-N using the precomputed sort order, restricted to the mask
+        order = self.sort_orders[sort_field]
+        order = order[::-1] if descending else order
+        values = self.frame[sort_field].to_numpy()
+        ranked = order[mask[order] & ~np.isnan(values[order])]
+        n = self._top_n(query)
+        rows = [self._row(self.frame.index[i]) for i in ranked[:n]]
+        direction = "highest" if descending else "lowest"
+        summary = (f"The {len(rows)} {scope} products with the {direction} {sort_field}, "
+                   f"ranked exactly over {len(ranked)} matching products.")
+        return {"intent": "top_n", "rows": rows, "summary": summary}
+
+    def _row(self, label):
+        return self.products[self.frame.index.get_loc(label)]
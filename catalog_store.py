@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import argparse
+from collections.abc import Sequence
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Typed, columnar catalog written by scraper.py (Arrow IPC, read memory-mapped)
+CATALOG_ARROW_PATH = os.getenv("CATALOG_ARROW_PATH", "cheese_data.arrow")
+# JSON interchange copy, still read when it is newer than the Arrow file
+CATALOG_JSON_PATH = os.getenv("CATALOG_JSON_PATH", "cheese_data.json")
+# Catalog file readers use; empty = whichever of the two above is newer
+CATALOG_PATH = os.getenv("CATALOG_PATH", "")
+# Also write the JSON copy whenever the Arrow catalog is written
+CATALOG_JSON_EXPORT = os.getenv("CATALOG_JSON_EXPORT", "true").lower() == "true"
+
+CATALOG_SCHEMA = pa.schema([
+    ("product_name", pa.string()),
+    ("company_name", pa.string()),
+    ("price", pa.float64()),
+    ("Unit", pa.string()),
+    ("Cost per pound", pa.float64()),
+    ("standard", pa.string()),
+    ("weight(pound)", pa.float64()),
+    ("SKU", pa.int64()),
+    ("UPC", pa.int64()),
+    ("image_url", pa.string()),
+    ("product_url", pa.string()),
+    ("image_path", pa.string()),
+])
+
+
+def _coerce(value, type_):
+    """A JSON value as the column type; placeholders such as "N/A" in number columns become null."""
+    if value is None:
+        return None
+    if pa.types.is_string(type_):
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if pa.types.is_integer(type_):
+        return int(number) if number.is_integer() else None
+    return number
+
+
+def products_to_table(products):
+    """Build a catalog table from product dicts.
+
+    Columns follow CATALOG_SCHEMA; fields outside it are kept as extra
+    string columns. A field a product does not have is null.
+    """
+    products = list(products)
+    schema = CATALOG_SCHEMA
+    known = set(schema.names)
+    for name in dict.fromkeys(key for product in products for key in product if key not in known):
+        schema = schema.append(pa.field(name, pa.string()))
+    columns = [
+        pa.array([_coerce(product.get(field.name), field.type) for product in products], type=field.type)
+        for field in schema
+    ]
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+def catalog_path():
+    """The catalog file to read: CATALOG_PATH, else the newer of the Arrow and JSON files."""
+    if CATALOG_PATH:
+        return CATALOG_PATH
+    try:
+        arrow_mtime = os.path.getmtime(CATALOG_ARROW_PATH)
+    except OSError:
+        return CATALOG_JSON_PATH
+    try:
+        json_mtime = os.path.getmtime(CATALOG_JSON_PATH)
+    except OSError:
+        return CATALOG_ARROW_PATH
+    # A hand-edited JSON file wins over an older Arrow file
+    return CATALOG_JSON_PATH if json_mtime > arrow_mtime else CATALOG_ARROW_PATH
+
+
+def read_table(path=None):
+    """Open the catalog as an Arrow table.
+
+    Arrow files are memory-mapped, so columns are read straight from the page
+    cache without parsing or copying. JSON files are parsed and converted.
+    """
+    path = path or catalog_path()
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return products_to_table(json.load(f))
+    with pa.memory_map(path, "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+class CatalogRecords(Sequence):
+    """Products of a catalog table as dicts, built only when a row is accessed.
+
+    Null fields are left out, so records look like the JSON they came from.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[i] for i in range(*position.indices(len(self)))]
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("catalog row out of range")
+        return self._records(self.table.slice(position, 1))[0]
+
+    def __iter__(self):
+        for batch in self.table.to_batches(max_chunksize=1024):
+            yield from self._records(batch)
+
+    @staticmethod
+    def _records(table):
+        return [{key: value for key, value in row.items() if value is not None} for row in table.to_pylist()]
+
+
+def load_catalog(path=None):
+    """The catalog's products (CatalogRecords over a memory-mapped table)."""
+    return CatalogRecords(read_table(path))
+
+
+def write_catalog(products, path=CATALOG_ARROW_PATH, json_path=CATALOG_JSON_PATH, export_json=CATALOG_JSON_EXPORT):
+    """Write the Arrow catalog atomically, and its JSON copy unless disabled. Returns the row count."""
+    table = products if isinstance(products, pa.Table) else products_to_table(products)
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+    if export_json and json_path:
+        write_json(table, json_path, source_path=path)
+    return table.num_rows
+
+
+def write_json(table, path=CATALOG_JSON_PATH, source_path=None):
+    """Export a catalog table in the original cheese_data.json layout."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(list(CatalogRecords(table)), f, ensure_ascii=False, indent=2)
+    if source_path is not None:
+        # Keep the copy from looking newer than its Arrow source (see catalog_path)
+        stat = os.stat(source_path)
+        os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(tmp_path, path)
+
+
+def import_json(json_path=CATALOG_JSON_PATH, path=CATALOG_ARROW_PATH):
+    """Convert a JSON catalog to the Arrow catalog. Returns the row count."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        products = json.load(f)
+    return write_catalog(products, path, export_json=False)
+
+
+def export_json(path=CATALOG_ARROW_PATH, json_path=CATALOG_JSON_PATH):
+    """Convert the Arrow catalog back to JSON. Returns the row count."""
+    table = read_table(path)
+    write_json(table, json_path, source_path=path)
+    return table.num_rows
+
+
+def describe(path=None):
+    """Row count, size and load timings of a catalog file."""
+    path = path or catalog_path()
+    started = time.perf_counter()
+    table = read_table(path)
+    opened = time.perf_counter() - started
+    started = time.perf_counter()
+    mean_price = pc.mean(table.column("price")).as_py()
+    scanned = time.perf_counter() - started
+    return {
+        "path": path,
+        "rows": table.num_rows,
+        "file_bytes": os.path.getsize(path),
+        "open_ms": round(opened * 1000, 2),
+        "mean_price_ms": round(scanned * 1000, 3),
+        "mean_price": mean_price,
+        "columns": table.schema.names,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert and inspect the catalog (Arrow <-> JSON)")
+    parser.add_argument("command", choices=["import", "export", "info"],
+                        help="import: JSON -> Arrow, export: Arrow -> JSON, info: sizes and load timings")
+    parser.add_argument("--arrow", default=CATALOG_ARROW_PATH)
+    parser.add_argument("--json", default=CATALOG_JSON_PATH)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        print(f"Wrote {import_json(args.json, args.arrow)} products to {args.arrow}")
+    elif args.command == "export":
+        print(f"Wrote {export_json(args.arrow, args.json)} products to {args.json}")
+    else:
+        for path in (args.json, args.arrow):
+            if os.path.exists(path):
+                print(json.dumps(describe(path)))
@@ -0,0 +1,26 @@
+import os
+import json
+import time
+import hashlib
+
+# Written by ingest.py whenever the indexed catalog changes
+CATALOG_VERSION_PATH = os.getenv("CATALOG_VERSION_PATH", "catalog_version.json")
+
+
+def publish_catalog_version(manifest, path=CATALOG_VERSION_PATH):
+    """Publish a version id derived from the ingest manifest's content hashes."""
+    digest = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": digest, "published_at": time.time(), "products": len(manifest)}, f)
+    os.replace(tmp_path, path)
+    return digest
+
+
+def read_catalog_version(path=CATALOG_VERSION_PATH):
+    """Return the currently published catalog version, or None if never published."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("version")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
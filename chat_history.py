@@ -0,0 +1,64 @@
+import os
+import json
+import zlib
+from collections import deque
+
+# Messages kept per session; older ones are dropped
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "200"))
+# Most recent messages kept as plain dicts; older retained ones are compressed
+HISTORY_HOT_MESSAGES = int(os.getenv("HISTORY_HOT_MESSAGES", "20"))
+# Messages rendered per page ("Load earlier" adds another page)
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+
+
+def _compress(message):
+    return zlib.compress(json.dumps(message, ensure_ascii=False).encode("utf-8"))
+
+
+def _decompress(blob):
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class ChatHistory:
+    """Bounded per-session chat log.
+
+    The newest hot_messages stay as dicts; older retained messages are kept
+    zlib-compressed and only decompressed when an earlier page is rendered.
+    Anything beyond max_messages is dropped.
+    """
+
+    def __init__(self, max_messages=HISTORY_MAX_MESSAGES, hot_messages=HISTORY_HOT_MESSAGES):
+        self.max_messages = max_messages
+        self.hot_messages = min(hot_messages, max_messages)
+        self.hot = deque()
+        self.cold = deque()
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.hot) + len(self.cold)
+
+    def append(self, role, content):
+        self.hot.append({"role": role, "content": content})
+        while len(self.hot) > self.hot_messages:
+            self.cold.append(_compress(self.hot.popleft()))
+        while len(self) > self.max_messages:
+            self.cold.popleft()
+            self.dropped += 1
+
+    def window(self, count):
+        """The last `count` messages, oldest first."""
+        count = min(count, len(self))
+        hot = list(self.hot)[-count:] if count else []
+        from_cold = count - len(hot)
+        cold = [_decompress(blob) for blob in list(self.cold)[len(self.cold) - from_cold:]] if from_cold else []
+        return cold + hot
+
+    def clear(self):
+        self.hot.clear()
+        self.cold.clear()
+        self.dropped = 0
+
+    def memory_bytes(self):
+        """Approximate bytes held for this session's messages."""
+        hot = sum(len(m["content"].encode("utf-8")) + len(m["role"]) for m in self.hot)
+        return hot + sum(len(blob) for blob in self.cold)
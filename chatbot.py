@@ -1,10 +1,19 @@
+import time
+SCRIPT_STARTED = time.perf_counter()
+
 import os
-import json
+import re
+import html
+import queue
+import asyncio
+import threading
 import streamlit as st
-from pinecone import Pinecone
-from openai import OpenAI
 from dotenv import load_dotenv
 import urllib3
+from engine import ChatEngine, VECTOR_BACKEND, EMBED_TIMEOUT, ANSWER_TIMEOUT
+from images import IMAGE_INDEX_PATH, source_image_url, thumbnail_map, thumbnail_url
+from chat_history import ChatHistory, HISTORY_PAGE_SIZE
+import telemetry
 
 # Disable SSL warnings
 urllib3.disable_warnings()
@@ -17,11 +26,46 @@ st.set_page_config(
     layout="wide",
     initial_sidebar_state="expanded"
 )
+@st.cache_resource
+def get_process_info():
+    """Per-process bookkeeping shared by all sessions (cold start timing)."""
+    return {"started_at": time.time(), "cold_start": None}
+
+@st.cache_data
+def read_css(css_file):
+    with open(css_file, "r") as f:
+        return f.read()
+
 # Load CSS
 def load_css(css_file):
-    with open(css_file, "r") as f:
-        css = f.read()
-    st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
+    st.markdown(f"<style>{read_css(css_file)}</style>", unsafe_allow_html=True)
+
+@st.cache_data
+def load_thumbnail_map(mtime):
+    """Remote image URL -> local thumbnail path; reloaded when the image index changes."""
+    return thumbnail_map()
+
+IMAGE_URL_RE = re.compile(r"https?://[^\s)\"'<>]+")
+
+def with_thumbnails(markdown):
+    """Point product images at local thumbnails (static files the browser caches).
+
+    Images without a thumbnail get the shop's smaller rendition instead of w=3840.
+    """
+    try:
+        thumbnails = load_thumbnail_map(os.path.getmtime(IMAGE_INDEX_PATH))
+    except OSError:
+        thumbnails = {}
+
+    def swap(match):
+        url = match.group(0)
+        path = thumbnails.get(url) or thumbnails.get(html.unescape(url))
+        return thumbnail_url(path) if path else source_image_url(url)
+
+    return IMAGE_URL_RE.sub(swap, markdown)
+
+def render_answer(answer, container=st):
+    container.markdown(f"<div class='assistant-message'>{with_thumbnails(answer)}</div>", unsafe_allow_html=True)
 
 # Load the CSS
 css_path = os.path.join(os.path.dirname(__file__), "style.css")
@@ -29,7 +73,10 @@ load_css(css_path)
 
 # Initialize session state
 if "messages" not in st.session_state:
-    st.session_state.messages = []
+    st.session_state.messages = ChatHistory()
+
+if "history_window" not in st.session_state:
+    st.session_state.history_window = HISTORY_PAGE_SIZE
 
 if "previous_answer" not in st.session_state:  # Add this initialization
     st.session_state.previous_answer = ""
@@ -56,8 +103,10 @@ with st.sidebar:
                      help="Click to clear all chat history",
                      type="secondary",
                      use_container_width=True):
-            st.session_state.messages = []
+            st.session_state.messages.clear()
+            st.session_state.history_window = HISTORY_PAGE_SIZE
             st.session_state.previous_answer = ""
+            st.session_state.pop("expandable", None)
             st.rerun()
     # if  st.button("🗑️ Save Chat History", 
     #                  help="Click to save all chat history",
@@ -73,222 +122,253 @@ st.markdown("--------------------------------")
 # Chat container with custom styling
 chat_container = st.container()
 
-# Display chat history in a beautiful way
+# Display chat history in a beautiful way; only the latest page(s) are rendered
 with chat_container:
-    for message in st.session_state.messages:
+    history = st.session_state.messages
+    hidden = len(history) - st.session_state.history_window
+    # A fixed label keeps the button's identity stable while the history grows
+    if hidden > 0 and st.button("⬆️ Load earlier messages", key="load_earlier"):
+        st.session_state.history_window += HISTORY_PAGE_SIZE
+        st.rerun()
+    for message in history.window(st.session_state.history_window):
         if message["role"] == "user":
             with st.chat_message("user", avatar="🧑"):
                 st.markdown(f"<div class='user-message'>{message['content']}</div>", unsafe_allow_html=True)
         else:
             with st.chat_message("assistant", avatar="🧀"):
-                st.markdown(f"<div class='assistant-message'>{message['content']}</div>", unsafe_allow_html=True)
+                render_answer(message['content'])
 
-# Initialize OpenAI
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-assert OPENAI_API_KEY is not None, "OPENAI_API_KEY environment variable not set"
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Render answers token by token instead of waiting for the full completion
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "true").lower() == "true"
 
-# Initialize Pinecone
-try:
-    PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
-    assert PINECONE_API_KEY is not None, "PINECONE_API_KEY environment variable not set"
-    pc = Pinecone(api_key=PINECONE_API_KEY)
-    index_name = "cheese-knowledge"
+@st.cache_resource
+def get_event_loop():
+    """One background event loop per process, so pooled async connections survive reruns."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True, name="chat-event-loop").start()
+    return loop
+
+def run_async(coro):
+    """Run a coroutine on the background loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+def iterate_async(agen):
+    """Iterate an async generator that runs on the background loop.
+
+    Items are handed over through a queue; if the consumer stops early the
+    generator's task is cancelled.
+    """
+    items = queue.Queue()
+    done = object()
+
+    async def produce():
+        try:
+            async for item in agen:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        finally:
+            items.put(done)
+
+    future = asyncio.run_coroutine_threadsafe(produce(), get_event_loop())
+    try:
+        while True:
+            item = items.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        future.cancel()
+
+@st.cache_resource(show_spinner=False)
+def get_engine(backend):
+    """The retrieval/answer engine, shared by every session in this process."""
+    return ChatEngine(backend=backend)
+
+# Prometheus /metrics endpoint (METRICS_PORT) and an optional sidebar debug panel
+DEBUG_PANEL = os.getenv("DEBUG_PANEL", "false").lower() == "true"
+
+@st.cache_resource
+def get_metrics_server():
+    """Start the /metrics endpoint once per process (no-op unless METRICS_PORT is set)."""
     try:
-        index = pc.Index(index_name)
-        # Verify index connection with a simple query
-        index.describe_index_stats()
-    except Exception as index_error:
-        st.sidebar.error(f"❌ Pinecone Error: {str(index_error)}")
-        st.stop()
+        return telemetry.start_metrics_server()
+    except OSError as e:
+        print(f"Could not start metrics server: {str(e)}")
+        return None
+
+get_metrics_server()
+
+# Seconds between background index health checks
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "60"))
+
+@st.cache_resource
+def get_index_health(_engine, backend):
+    """Check the index in a background thread instead of on every rerun."""
+    health = {"ok": None, "error": None, "stats": None, "checked_at": None}
+
+    def check_loop():
+        while True:
+            try:
+                stats = _engine.index.describe_index_stats()
+                health.update(ok=True, error=None, stats=stats)
+            except Exception as e:
+                health.update(ok=False, error=str(e))
+            health["checked_at"] = time.time()
+            time.sleep(HEALTH_CHECK_INTERVAL)
+
+    threading.Thread(target=check_loop, daemon=True, name="index-health-check").start()
+    return health
+
+# Initialize the engine (OpenAI client, caches and vector index)
+try:
+    engine = get_engine(VECTOR_BACKEND)
+    index = engine.index
 except Exception as e:
     st.sidebar.error(f"❌ Connection Error: {str(e)}")
     st.stop()
 
+index_health = get_index_health(engine, VECTOR_BACKEND)
+if index_health["ok"] is False:
+    st.sidebar.error(f"❌ Index Error: {index_health['error']}")
+
+# Startup timing: the first run in a process is the cold start
+process_info = get_process_info()
+setup_seconds = time.perf_counter() - SCRIPT_STARTED
+if process_info["cold_start"] is None:
+    process_info["cold_start"] = setup_seconds
+    print(f"Cold start: {setup_seconds:.2f}s")
+st.sidebar.caption(
+    f"⏱️ Cold start {process_info['cold_start']:.2f}s · this run's setup {setup_seconds * 1000:.0f}ms"
+)
+st.sidebar.caption(
+    f"💬 {len(history)} messages kept · {history.memory_bytes() / 1024:.1f} KB this session"
+    + (f" · {history.dropped} oldest dropped" if history.dropped else "")
+)
+
 def embed_text(text):
     try:
-        response = client.embeddings.create(
-            input=[text],
-            model="text-embedding-3-small"
-        )
-        return response.data[0].embedding
+        return run_async(asyncio.wait_for(engine.embed_text(text), EMBED_TIMEOUT))
     except Exception as e:
         st.error(f"Error generating embedding: {str(e)}")
         return None
 
 def get_filter_from_llm(query):
-    """Get filter from LLM in a simple way"""
-    try:
-        prompt = f"""
-            Extract a metadata filter from the user query. Return only valid JSON only using fields from this list:
-            ["price", "company_name", "Unit", "Cost per pound", "standard", "weight(pound)", "image_path"]
-
-            Examples:
-            - "Show me cheeses under $20" → {{"price": {{"$lt": 20}}}}
-            - "What is the most expensive cheese product?" → {{"price": {{"$gt": 190}}}}
-            - "Cheeses by Tillamook" → {{"company_name": {{"$eq": "Tillamook"}}}}
-            - "Show me cheeses under 5 pounds" → {{"weight(pound)": {{"$lt": 5}}}}
-            - "What is the cheapest cheese?" → {{"price": {{"$lt": 20}}}}
-            Query: {query}
-            """
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0
-        )
-        
-        filter_str = response.choices[0].message.content.strip()
-        # Clean up the response to ensure it's valid JSON
-        filter_str = filter_str.replace("→", "->").strip()
-        if filter_str.startswith("->"):
-            filter_str = filter_str[2:].strip()
-        
-        try:
-            return json.loads(filter_str)
-        except json.JSONDecodeError:
-            print(f"Failed to parse filter: {filter_str}")
-            return None
-            
-    except Exception as e:
-        print(f"Error getting filter from LLM: {str(e)}")
-        return None
+    """Get filter from the local rule-based parser, or from the LLM when it is unsure"""
+    return run_async(engine.get_filter(query))
 
 def search_pinecone(query, top_k=5):
     try:
         # Verify index is available
-        if not index:
-            st.error("Pinecone index is not initialized")
+        if index is None:
+            st.error("Vector index is not initialized")
             return []
-            
-        embedding = embed_text(query)
-        if embedding is None:
-            return []
-            
-        # Get filter from LLM
-        filter_dict = get_filter_from_llm(query)
-        
-        # Prepare query parameters
-        query_params = {
-            "vector": embedding,
-            "top_k": top_k,
-            "include_metadata": True
-        }
-        
-        # Add filter if available and valid
-        if filter_dict and isinstance(filter_dict, dict):
-            query_params["filter"] = filter_dict
-            # print(f"Using filter: {filter_dict}")
-            
-        try:
-            # Execute query
-            results = index.query(**query_params)
-            if not results or 'matches' not in results:
-                print("No results found in Pinecone query")
-                return []
-            return [match['metadata'] for match in results['matches']]
-        except Exception as query_error:
-            st.error(f"Error executing Pinecone query: {str(query_error)}")
-            return []
-        
+        return run_async(engine.search(query, top_k))
     except Exception as e:
         st.error(f"Error in search_pinecone: {str(e)}")
         return []
 
 def ask_gpt(question, context,previous_answer):
     try:
-        prompt = f"""
-            When a user asks a question, do the following:
-
-            - If it's about cheese, answer using the cheese data only.
-                    You are an expert cheese sommelier and product specialist. Answer the user's question using the provided cheese information in comprehensive detail, including product details and shopping information.
-                    
-                    CHEESE INFORMATION:
-                    {context}
-                    you must provide the information that user asked for.
-                    only if user demand more information , you must answer the question including:
-                        
-                        1. PRODUCT INFORMATION:
-                        - Product name and brand
-                        - URL where the product can be purchased (format as clickable link)
-                        - SKU/UPC codes for reference
-                        - Include image URLs in your response (format as markdown: ![Cheese Image](image_url)) 
-                        - Price information, weights, and packaging options
-                        
-                        2. CHEESE CHARACTERISTICS:
-                        - FLAVOR PROFILE: Describe the complex flavors, aromas, taste progression, and intensity
-                        - TEXTURE: Detail the mouthfeel, consistency, and physical characteristics  
-                        - APPEARANCE: Describe the color, rind, interior, and visual aspects
-                        - ORIGIN: Explain the geographical and cultural significance of this cheese
-                        
-                Guidelines:
-                • Format your response in a clean, organized way with clear sections and markdown formatting
-                • Include ALL available product details (URLs, SKUs, images, pricing)
-                • If showing multiple products, create a separate section for each with its own details
-                • For images, include at least one image URL formatted as markdown if available
-                • Include links to the product and related/similar products formatted as markdown
-                • Be thorough but conversational, like an enthusiastic cheese expert sharing their passion
-            - If it's a general food-related question (not about cheese), give a common, non-political, non-character-based answer and generate image.
-            - Use casual American English.
-            
-            Answer this answer is previous your answer:{previous_answer}
-            If user ask the question related to previous answer, You must answer the question based on previous answer and user question.
-            User question: {question}
-            """
-        # print(f"Prompt: {prompt}\n\n")
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "user", "content": prompt}]
-        )
-        return response.choices[0].message.content
+        return run_async(asyncio.wait_for(engine.ask_gpt(question, context, previous_answer), ANSWER_TIMEOUT))
     except Exception as e:
         st.error(f"Error getting GPT response: {str(e)}")
         return "Sorry, I encountered an error while processing your question."
 
 
+def request_expansion():
+    # Runs before the rerun, so the turn below picks the question up
+    st.session_state.expand_question = st.session_state.pop("expandable", None)
+
+
 prompt = st.chat_input("Ask a question about cheese...", key="chat_input")
+# "Tell me more" on a product-card answer asks gpt-4o about the same question
+expand_question = st.session_state.pop("expand_question", None)
+
+if prompt or expand_question:
+    question = prompt or expand_question
+    mode = "auto" if prompt else "generate"
+    shown_prompt = prompt or "✨ Tell me more"
+    st.session_state.pop("expandable", None)
 
-if prompt:
     # Add user message to chat history
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    
+    st.session_state.messages.append("user", shown_prompt)
+    # A new turn collapses any pages loaded with "Load earlier messages"
+    st.session_state.history_window = HISTORY_PAGE_SIZE
+
     # Display user message
     with st.chat_message("user"):
-        st.markdown(prompt)
+        st.markdown(shown_prompt)
     
     # Get and display assistant response
-    with st.chat_message("assistant"):
-        with st.spinner("🧀 Thinking..."):
-            try:
-                contexts = search_pinecone(prompt)
-                if contexts:
-                    context_text = "\n".join([
-                        f"product_name: {cheese['product_name']}. company_name: {cheese['company_name']}. SKU: {cheese['SKU']}. UPC: {cheese['UPC']}. \
-                            price: {cheese['price']}. Cost per pound: {cheese['Cost per pound']}. Unit: {cheese['Unit']}. Weight: {cheese['weight(pound)']}. standard: {cheese['standard']}. image_url: {cheese['image_url']}"
-                        for cheese in contexts
-                    ])
-                    
-                    answer = ask_gpt(prompt, context_text , st.session_state.previous_answer)
-                    st.session_state.previous_answer = answer
-                    # Display answer with custom styling\                    
-                    st.markdown(f"<div class='assistant-message'>{answer}</div>", unsafe_allow_html=True)
-                    
-                    # Add assistant response to chat history
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": answer
-                    })
+    stats = {}
+    with st.chat_message("assistant"), telemetry.trace("turn") as turn_trace:
+        try:
+            if STREAM_ANSWERS:
+                events = iterate_async(engine.stream_turn(question, st.session_state.previous_answer,
+                                                          stats=stats, mode=mode))
+                with st.spinner("🧀 Thinking..."):
+                    # The first event arrives once retrieval is done
+                    next(events)
+                # Render tokens as they arrive, with product images swapped for thumbnails
+                placeholder = st.empty()
+                answer = ""
+                for event in events:
+                    if event["event"] == "delta":
+                        answer += event["text"]
+                        placeholder.markdown(with_thumbnails(answer) + "▌")
+                    elif event["event"] == "done":
+                        answer = event["answer"]
+                if answer:
+                    render_answer(answer, placeholder)
+                    st.session_state.last_ttft = stats.get("ttft")
+                    print(f"Answer streamed: first token {stats.get('ttft', 0):.2f}s, "
+                          f"complete {stats.get('total', 0):.2f}s")
                 else:
-                    st.warning("No relevant cheese information found. Please try a different question.")
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": "No relevant cheese information found. Please try a different question."
-                    })
-            except Exception as e:
-                error_message = f"An error occurred: {str(e)}"
-                st.error(error_message)
-                st.session_state.messages.append({
-                    "role": "assistant",
-                    "content": error_message
-                })
+                    placeholder.empty()
+            else:
+                with st.spinner("🧀 Thinking..."):
+                    contexts, answer = run_async(engine.answer_turn(question, st.session_state.previous_answer,
+                                                                    mode=mode, stats=stats))
+                if answer:
+                    # Display answer with custom styling
+                    render_answer(answer)
+
+            if answer:
+                st.session_state.previous_answer = answer
+
+                # Add assistant response to chat history
+                st.session_state.messages.append("assistant", answer)
+                if stats.get("mode") == "template":
+                    st.session_state.expandable = question
+            else:
+                st.warning("No relevant cheese information found. Please try a different question.")
+                st.session_state.messages.append(
+                    "assistant", "No relevant cheese information found. Please try a different question."
+                )
+        except TimeoutError as e:
+            telemetry.error("turn", e)
+            error_message = "Sorry, that took too long to answer. Please try again."
+            st.error(error_message)
+            st.session_state.messages.append("assistant", error_message)
+        except Exception as e:
+            telemetry.error("turn", e)
+            error_message = f"An error occurred: {str(e)}"
+            st.error(error_message)
+            st.session_state.messages.append("assistant", error_message)
+    st.session_state.last_trace = turn_trace.summary()
+
+if st.session_state.get("expandable"):
+    st.button("✨ Tell me more", key="tell_me_more", on_click=request_expansion)
 
+if DEBUG_PANEL:
+    with st.sidebar.expander("🔍 Debug", expanded=True):
+        st.markdown("**Last turn**")
+        st.table(st.session_state.get("last_trace") or [])
+        snapshot = telemetry.metrics.snapshot()
+        st.markdown("**Counters**")
+        st.json(snapshot["counters"], expanded=False)
+        st.markdown("**Stage timings (process)**")
+        st.json(snapshot["histograms"], expanded=False)
@@ -0,0 +1,137 @@
+import os
+import re
+from functools import lru_cache
+from rate_limiter import estimate_tokens
+
+# Token budgets for the answer prompt (the fixed instructions come on top)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "400"))
+ANSWER_MODEL = "gpt-4o"
+
+_URL_RE = re.compile(r"https?://[^\s)\"'<>]+")
+_IMAGE_MD_RE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+_REF_RE = re.compile(r"\b(img\d+|link\d+)\b")
+_EMPTY = (None, "", "N/A")
+
+
+@lru_cache(maxsize=4)
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # The BPE file is downloaded on first use; offline hosts fall back to estimates
+        print(f"Could not load tokenizer for {model}, estimating tokens: {str(e)}")
+        return None
+
+
+def count_tokens(text, model=ANSWER_MODEL):
+    """Tokens in text for the model; a chars/4 estimate when tiktoken is missing."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, budget, model=ANSWER_MODEL):
+    """Cut text down to at most `budget` tokens, marking the cut with an ellipsis."""
+    if count_tokens(text, model) <= budget:
+        return text
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:max(0, budget * 4 - 1)].rstrip() + "…"
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max(0, budget - 1)]).rstrip() + "…"
+
+
+class References:
+    """Short names (img1, link1, ...) for long URLs, expanded back in the answer."""
+
+    def __init__(self):
+        self.urls = {}
+        self._by_url = {}
+        self._counts = {}
+
+    def add(self, url, prefix):
+        if url in self._by_url:
+            return self._by_url[url]
+        self._counts[prefix] = self._counts.get(prefix, 0) + 1
+        name = f"{prefix}{self._counts[prefix]}"
+        self.urls[name] = url
+        self._by_url[url] = name
+        return name
+
+    def expand(self, text):
+        """Replace references the model echoed with the URLs they stand for."""
+        if not self.urls:
+            return text
+        return _REF_RE.sub(lambda m: self.urls.get(m.group(1), m.group(1)), text)
+
+
+def compact_product(cheese, refs):
+    """One line per product, skipping empty fields, a UPC equal to the SKU, and long URLs."""
+    parts = [f"{cheese.get('product_name')} by {cheese.get('company_name')}"]
+    for label, field in (("price", "price"), ("per lb", "Cost per pound"), ("unit", "Unit"),
+                         ("weight lb", "weight(pound)"), ("size", "standard"), ("SKU", "SKU")):
+        value = cheese.get(field)
+        if value not in _EMPTY:
+            parts.append(f"{label}: {value}")
+    if cheese.get("UPC") not in _EMPTY and str(cheese.get("UPC")) != str(cheese.get("SKU")):
+        parts.append(f"UPC: {cheese['UPC']}")
+    if cheese.get("image_url") not in _EMPTY:
+        parts.append(f"image: {refs.add(cheese['image_url'], 'img')}")
+    if cheese.get("product_url") not in _EMPTY:
+        parts.append(f"url: {refs.add(cheese['product_url'], 'link')}")
+    return "- " + "; ".join(parts)
+
+
+def compact_history(previous_answer, budget=HISTORY_TOKEN_BUDGET, model=ANSWER_MODEL):
+    """Shrink the previous answer for the prompt: no images or URLs, bounded tokens."""
+    if not previous_answer:
+        return ""
+    text = _IMAGE_MD_RE.sub("", previous_answer)
+    text = _URL_RE.sub("", text)
+    text = re.sub(r"\n\s*\n+", "\n", text).strip()
+    return truncate_tokens(text, budget, model)
+
+
+def build_context(contexts, summary=None, budget=CONTEXT_TOKEN_BUDGET, model=ANSWER_MODEL):
+    """Build the product context block within a token budget.
+
+    Products are added in rank order until the budget is used up. Returns
+    (context, refs, accounting) where refs expands the URL references in the
+    model's answer and accounting records what went in.
+    """
+    refs = References()
+    lines = []
+    used = 0
+    if summary:
+        header = f"EXACT CATALOG RESULT (computed over the full catalog, use these numbers as-is):\n{summary}\n"
+        header = truncate_tokens(header, budget // 2, model)
+        lines.append(header)
+        used += count_tokens(header, model)
+
+    included = 0
+    for cheese in contexts:
+        line = compact_product(cheese, refs)
+        tokens = count_tokens(line, model) + 1
+        if used + tokens > budget and included:
+            break
+        lines.append(line)
+        used += tokens
+        included += 1
+
+    if refs.urls:
+        lines.append("Refer to images and links by their short names (e.g. ![Cheese Image](img1)); "
+                     "they are replaced with the real URLs.")
+    context = "\n".join(lines)
+    accounting = {
+        "context_tokens": count_tokens(context, model),
+        "products_included": included,
+        "products_dropped": len(contexts) - included,
+    }
+    return context, refs, accounting
@@ -0,0 +1,201 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import telemetry
+
+EMBED_MODEL = "text-embedding-3-small"  # 1536 dimensions
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "100000"))
+EMBEDDING_CACHE_HOT_SIZE = int(os.getenv("EMBEDDING_CACHE_HOT_SIZE", "2048"))
+
+
+def normalize_text(text):
+    """Collapse whitespace so formatting-only differences share a cache entry."""
+    return " ".join(text.split())
+
+
+def cache_key(model, text):
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Content-addressed embedding cache: in-memory LRU over a SQLite store.
+
+    Keys are sha256(model, normalized text). The hot tier keeps float32
+    arrays; the SQLite tier is bounded to max_rows, evicting least recently
+    used rows once it grows past that.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_rows=EMBEDDING_CACHE_MAX_ROWS,
+                 hot_size=EMBEDDING_CACHE_HOT_SIZE):
+        self.max_rows = max_rows
+        self.hot_size = hot_size
+        self.hot = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT, vector BLOB, last_used REAL)"
+        )
+        self.db.commit()
+        # Approximate (other processes write too); recounted before evicting
+        self.rows = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _remember(self, key, vector):
+        self.hot[key] = vector
+        self.hot.move_to_end(key)
+        while len(self.hot) > self.hot_size:
+            self.hot.popitem(last=False)
+
+    def get_many(self, model, texts):
+        """Return cached vectors (lists of floats) in input order, None for misses."""
+        keys = [cache_key(model, text) for text in texts]
+        results = [None] * len(keys)
+        with self.lock:
+            cold = []
+            for pos, key in enumerate(keys):
+                if key in self.hot:
+                    self.hot.move_to_end(key)
+                    results[pos] = self.hot[key].tolist()
+                else:
+                    cold.append(pos)
+
+            if cold:
+                wanted = list({keys[pos] for pos in cold})
+                found = {}
+                # Stay well below SQLite's bound-parameter limit
+                for start in range(0, len(wanted), 500):
+                    chunk = wanted[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    for key, blob in self.db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                    ):
+                        found[key] = np.frombuffer(blob, dtype=np.float32)
+                if found:
+                    now = time.time()
+                    self.db.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                        [(now, key) for key in found],
+                    )
+                    self.db.commit()
+                for pos in cold:
+                    vector = found.get(keys[pos])
+                    if vector is not None:
+                        self._remember(keys[pos], vector)
+                        results[pos] = vector.tolist()
+
+            hits = sum(vector is not None for vector in results)
+            self.hits += hits
+            self.misses += len(results) - hits
+        telemetry.count("embedding_cache_total", hits, result="hit")
+        telemetry.count("embedding_cache_total", len(results) - hits, result="miss")
+        return results
+
+    def put_many(self, model, texts, vectors):
+        now = time.time()
+        rows = []
+        with self.lock:
+            for text, vector in zip(texts, vectors):
+                key = cache_key(model, text)
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, model, vector.tobytes(), now))
+            keys = [row[0] for row in rows]
+            existing = 0
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                existing += self.db.execute(
+                    f"SELECT COUNT(*) FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchone()[0]
+            self.db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+            self.rows += len(rows) - existing
+            if self.rows > self.max_rows:
+                self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        """Trim the SQLite tier to 90% of max_rows, so the LRU sort runs only now and then."""
+        self.rows = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self.rows - int(self.max_rows * 0.9)
+        if self.rows <= self.max_rows or excess <= 0:
+            return
+        self.db.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used, rowid LIMIT ?)",
+            (excess,),
+        )
+        self.rows -= excess
+
+    def stats(self):
+        with self.lock:
+            rows = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "hot_entries": len(self.hot),
+                "stored_entries": rows,
+            }
+
+
+def _split_misses(texts, model, cache):
+    cached = cache.get_many(model, texts) if cache is not None else [None] * len(texts)
+    missing = [pos for pos, vector in enumerate(cached) if vector is None]
+    return cached, missing
+
+
+def _sorted_embeddings(response):
+    # The API may return items out of order; sort them back by input position
+    return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+
+def embed_texts(client, texts, model=EMBED_MODEL, cache=None, before_request=None):
+    """Embed texts with one request for whatever is not already cached.
+
+    before_request, if given, is called with the texts about to be sent
+    (e.g. to apply rate limiting).
+    """
+    texts = list(texts)
+    results, missing = _split_misses(texts, model, cache)
+    if missing:
+        to_send = [texts[pos] for pos in missing]
+        if before_request is not None:
+            before_request(to_send)
+        response = client.embeddings.create(input=to_send, model=model)
+        vectors = _sorted_embeddings(response)
+        if cache is not None:
+            cache.put_many(model, to_send, vectors)
+        for pos, vector in zip(missing, vectors):
+            results[pos] = vector
+    return results
+
+
+async def embed_texts_async(async_client, texts, model=EMBED_MODEL, cache=None, call=None):
+    """Async counterpart of embed_texts.
+
+    call, if given, makes the request: it is awaited as call(send, texts)
+    where send() performs the API request (e.g. to add retries and limits).
+    """
+    texts = list(texts)
+    # SQLite reads and writes block, so they run off the event loop
+    results, missing = await asyncio.to_thread(_split_misses, texts, model, cache)
+    if missing:
+        to_send = [texts[pos] for pos in missing]
+        send = lambda: async_client.embeddings.create(input=to_send, model=model)
+        response = await (call(send, to_send) if call is not None else send())
+        vectors = _sorted_embeddings(response)
+        if cache is not None:
+            await asyncio.to_thread(cache.put_many, model, to_send, vectors)
+        for pos, vector in zip(missing, vectors):
+            results[pos] = vector
+    return results
@@ -0,0 +1,564 @@
+import os
+import re
+import json
+import time
+import asyncio
+import threading
+import httpx
+from openai import AsyncOpenAI
+from dotenv import load_dotenv
+from local_index import LOCAL_INDEX_PATH, LOCAL_INDEX_QUANTIZATION, LocalIndex, matches_filter
+from lexical_index import LEXICAL_INDEX_PATH, LexicalIndex, reciprocal_rank_fusion
+from query_parser import parse_filter
+from catalog_query import CatalogQuery
+from catalog_store import catalog_path
+from context_builder import build_context, compact_history, count_tokens
+from answer_cache import AnswerCache, is_follow_up
+from embeddings import EmbeddingCache, embed_texts_async, normalize_text
+from product_cards import TEMPLATE_ANSWERS, is_lookup, render_cards
+from rate_limiter import estimate_tokens
+from upstream import Upstream, UpstreamUnavailable, EMBED_RPM, EMBED_TPM, CHAT_RPM, CHAT_TPM
+import telemetry
+
+load_dotenv()
+
+# Per-turn deadline and per-stage timeouts, in seconds
+TURN_DEADLINE = float(os.getenv("TURN_DEADLINE", "60"))
+EMBED_TIMEOUT = float(os.getenv("EMBED_TIMEOUT", "10"))
+FILTER_TIMEOUT = float(os.getenv("FILTER_TIMEOUT", "15"))
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", "10"))
+ANSWER_TIMEOUT = float(os.getenv("ANSWER_TIMEOUT", "45"))
+
+# Pooled upstream connections shared by every request the engine serves
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))
+
+# Answer cache in front of retrieval + generation; invalidated by new catalog versions
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+
+# Vector backend: "pinecone" (default) or "local" (in-process NumPy index written by ingest.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone").lower()
+
+# Fuse BM25 lexical hits (and exact SKU/UPC lookups) with vector results
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+
+# Answer aggregate/superlative questions ("cheapest", "how many", "average price")
+# exactly from the catalog instead of approximating them with vector search
+STRUCTURED_QUERIES = os.getenv("STRUCTURED_QUERIES", "true").lower() == "true"
+
+# Local parser results at or above this confidence skip the LLM filter call
+FILTER_CONFIDENCE_THRESHOLD = float(os.getenv("FILTER_CONFIDENCE_THRESHOLD", "0.8"))
+
+# A streamed answer may end in half of a reference ("im", "img1") that the next chunk completes
+_PARTIAL_REF_RE = re.compile(r"(?:i|im|img\d*|l|li|lin|link\d*)$")
+
+
+def build_filter_prompt(query):
+    return f"""
+        Extract a metadata filter from the user query. Return only valid JSON only using fields from this list:
+        ["price", "company_name", "Unit", "Cost per pound", "standard", "weight(pound)", "image_path"]
+
+        Examples:
+        - "Show me cheeses under $20" → {{"price": {{"$lt": 20}}}}
+        - "What is the most expensive cheese product?" → {{"price": {{"$gt": 190}}}}
+        - "Cheeses by Tillamook" → {{"company_name": {{"$eq": "Tillamook"}}}}
+        - "Show me cheeses under 5 pounds" → {{"weight(pound)": {{"$lt": 5}}}}
+        - "What is the cheapest cheese?" → {{"price": {{"$lt": 20}}}}
+        Query: {query}
+        """
+
+
+def parse_llm_filter(filter_str):
+    """Turn the LLM's filter reply into a dict, or None if it is not valid JSON"""
+    filter_str = filter_str.strip()
+    # Clean up the response to ensure it's valid JSON
+    filter_str = filter_str.replace("→", "->").strip()
+    if filter_str.startswith("->"):
+        filter_str = filter_str[2:].strip()
+
+    try:
+        return json.loads(filter_str)
+    except json.JSONDecodeError:
+        print(f"Failed to parse filter: {filter_str}")
+        return None
+
+
+def build_answer_prompt(question, context, previous_answer):
+    return f"""
+        When a user asks a question, do the following:
+
+        - If it's about cheese, answer using the cheese data only.
+                You are an expert cheese sommelier and product specialist. Answer the user's question using the provided cheese information in comprehensive detail, including product details and shopping information.
+
+                CHEESE INFORMATION:
+                {context}
+                you must provide the information that user asked for.
+                only if user demand more information , you must answer the question including:
+
+                    1. PRODUCT INFORMATION:
+                    - Product name and brand
+                    - URL where the product can be purchased (format as clickable link)
+                    - SKU/UPC codes for reference
+                    - Include image URLs in your response (format as markdown: ![Cheese Image](image_url))
+                    - Price information, weights, and packaging options
+
+                    2. CHEESE CHARACTERISTICS:
+                    - FLAVOR PROFILE: Describe the complex flavors, aromas, taste progression, and intensity
+                    - TEXTURE: Detail the mouthfeel, consistency, and physical characteristics
+                    - APPEARANCE: Describe the color, rind, interior, and visual aspects
+                    - ORIGIN: Explain the geographical and cultural significance of this cheese
+
+            Guidelines:
+            • Format your response in a clean, organized way with clear sections and markdown formatting
+            • Include ALL available product details (URLs, SKUs, images, pricing)
+            • If showing multiple products, create a separate section for each with its own details
+            • For images, include at least one image URL formatted as markdown if available
+            • Include links to the product and related/similar products formatted as markdown
+            • Be thorough but conversational, like an enthusiastic cheese expert sharing their passion
+        - If it's a general food-related question (not about cheese), give a common, non-political, non-character-based answer and generate image.
+        - Use casual American English.
+
+        Answer this answer is previous your answer:{compact_history(previous_answer)}
+        If user ask the question related to previous answer, You must answer the question based on previous answer and user question.
+        User question: {question}
+        """
+
+
+def log_token_usage(question, context, previous_answer, accounting, usage):
+    """Print per-turn prompt accounting next to the usage the API reported."""
+    prompt_tokens = count_tokens(build_answer_prompt(question, context, previous_answer))
+    reported = f", API prompt {usage.prompt_tokens} / completion {usage.completion_tokens}" if usage else ""
+    print(f"Tokens: prompt {prompt_tokens} (context {accounting['context_tokens']}, "
+          f"history {count_tokens(compact_history(previous_answer))}, "
+          f"{accounting['products_included']} products, {accounting['products_dropped']} dropped){reported}")
+
+
+def fallback_answer(contexts, summary=None):
+    """Product cards from metadata, for when gpt-4o is unavailable."""
+    return render_cards(contexts, summary,
+                        note="Sorry, I can't write a full answer right now, but here is what I found in the catalog:")
+
+
+def open_vector_index(backend=VECTOR_BACKEND, quantization=LOCAL_INDEX_QUANTIZATION):
+    """Open the vector index for the configured backend (quantization applies to the local one)."""
+    if backend == "local":
+        return LocalIndex(quantization=quantization)
+    # Imported lazily so the local backend never pays for the Pinecone client
+    from pinecone import Pinecone
+    PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+    assert PINECONE_API_KEY is not None, "PINECONE_API_KEY environment variable not set"
+    pc = Pinecone(api_key=PINECONE_API_KEY, host=os.getenv("PINECONE_HOST"))
+    index_name = "cheese-knowledge"
+    return pc.Index(index_name)
+
+
+class _FileBacked:
+    """A loader result that is rebuilt when its source file (or its mtime) changes.
+
+    path may be a function returning the current path; load receives the path.
+    """
+
+    def __init__(self, path, load):
+        self.path = path
+        self.load = load
+        self.lock = threading.Lock()
+        self.version = None
+        self.value = None
+
+    def get(self):
+        path = self.path() if callable(self.path) else self.path
+        try:
+            version = (path, os.path.getmtime(path))
+        except OSError:
+            return None
+        with self.lock:
+            if version != self.version:
+                self.value = self.load(path)
+                self.version = version
+            return self.value
+
+
+class ChatEngine:
+    """The retrieval and answer pipeline, independent of any UI.
+
+    One engine per process: it owns the pooled async OpenAI client, the
+    caches and the indexes. Its coroutines must all run on one event loop
+    (the pooled HTTP client is bound to it); chatbot.py runs them on a
+    background loop thread and server.py on the server's loop.
+    """
+
+    def __init__(self, api_key=None, backend=VECTOR_BACKEND, answer_cache=ANSWER_CACHE_ENABLED,
+                 hybrid=HYBRID_SEARCH, structured=STRUCTURED_QUERIES, quantization=LOCAL_INDEX_QUANTIZATION):
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        assert api_key is not None, "OPENAI_API_KEY environment variable not set"
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                max_keepalive_connections=OPENAI_MAX_KEEPALIVE),
+            timeout=httpx.Timeout(TURN_DEADLINE, connect=5.0),
+        )
+        # Retries are ours (upstream.py), so the SDK's own are turned off
+        self.client = AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+        self.embeddings = Upstream("embeddings", rpm=EMBED_RPM, tpm=EMBED_TPM)
+        self.chat = Upstream("chat", rpm=CHAT_RPM, tpm=CHAT_TPM)
+        self.backend = backend
+        self.quantization = quantization
+        if backend == "local":
+            # Reopened when ingest.py rewrites it, like the lexical index and catalog below
+            self._index = _FileBacked(f"{LOCAL_INDEX_PATH}.json",
+                                      lambda path: open_vector_index(backend, quantization))
+        else:
+            self._index = open_vector_index(backend, quantization)
+        self.embedding_cache = EmbeddingCache()
+        self.answer_cache = AnswerCache() if answer_cache else None
+        self._lexical = _FileBacked(LEXICAL_INDEX_PATH, LexicalIndex) if hybrid else None
+        self._catalog = _FileBacked(catalog_path, CatalogQuery.from_catalog) if structured else None
+
+    @property
+    def index(self):
+        """The vector index; the local one is reopened when ingest.py rewrites it."""
+        if not isinstance(self._index, _FileBacked):
+            return self._index
+        index = self._index.get()
+        if index is None:
+            raise Exception(f"Local index not found at {LOCAL_INDEX_PATH}.json. Run ingest.py first.")
+        return index
+
+    def lexical_index(self):
+        """The lexical index written by ingest.py, or None if off or not built yet."""
+        return self._lexical.get() if self._lexical else None
+
+    def catalog_query(self):
+        """The columnar catalog for structured questions, or None if off or missing."""
+        return self._catalog.get() if self._catalog else None
+
+    def cache_for(self, question, previous_answer, mode="auto"):
+        # Follow-ups depend on previous_answer, so they never use the cache; nor do
+        # "tell me more" expansions, so the same lookup keeps getting its cards
+        if self.answer_cache is None or mode != "auto" or is_follow_up(question, previous_answer):
+            return None
+        return self.answer_cache
+
+    def use_template(self, question, previous_answer, contexts, summary, mode="auto"):
+        """Whether to answer with product cards instead of generating an answer."""
+        if mode != "auto" or not TEMPLATE_ANSWERS or not (contexts or summary):
+            return False
+        # Follow-ups need the previous answer, which only the LLM can use
+        return not is_follow_up(question, previous_answer) and is_lookup(question, exact=summary is not None)
+
+    async def _embed_call(self, send, texts):
+        return await self.embeddings.call(send, key=tuple(normalize_text(t) for t in texts),
+                                          tokens=sum(estimate_tokens(t) for t in texts))
+
+    async def embed_text(self, text):
+        with telemetry.span("embed"):
+            vectors = await embed_texts_async(self.client, [text], cache=self.embedding_cache,
+                                              call=self._embed_call)
+        return vectors[0]
+
+    async def _complete(self, prompt, key, **kwargs):
+        """One gpt-4o completion through the chat upstream; identical prompts share a call."""
+        async def send():
+            response = await self.client.chat.completions.create(
+                model="gpt-4o",
+                messages=[{"role": "user", "content": prompt}],
+                **kwargs
+            )
+            telemetry.record_usage(response.usage)
+            return response
+        return await self.chat.call(send, key=(key, prompt), tokens=estimate_tokens(prompt))
+
+    async def get_filter(self, query):
+        """Get filter from the local rule-based parser, or from the LLM when it is unsure"""
+        try:
+            filter_dict, confidence = parse_filter(query)
+            if confidence >= FILTER_CONFIDENCE_THRESHOLD:
+                telemetry.count("filters_total", source="local")
+                return filter_dict
+        except Exception as e:
+            telemetry.error("filter_local", e)
+            print(f"Local filter parser failed, falling back to LLM: {str(e)}")
+
+        try:
+            with telemetry.span("filter_llm"):
+                response = await self._complete(build_filter_prompt(query), "filter", temperature=0)
+            telemetry.count("filters_total", source="llm")
+            return parse_llm_filter(response.choices[0].message.content)
+        except Exception as e:
+            telemetry.error("filter_llm", e)
+            print(f"Error getting filter from LLM: {str(e)}")
+            return None
+
+    async def query_index(self, embedding, filter_dict, top_k=5):
+        """Run the (blocking) vector index query in a worker thread"""
+        query_params = {
+            "vector": embedding,
+            "top_k": top_k,
+            "include_metadata": True
+        }
+        # Add filter if available and valid
+        if filter_dict and isinstance(filter_dict, dict):
+            query_params["filter"] = filter_dict
+
+        with telemetry.span("vector_query"):
+            results = await asyncio.to_thread(self.index.query, **query_params)
+        if not results or 'matches' not in results:
+            print("No results found in vector query")
+            return []
+        return [match['metadata'] for match in results['matches']]
+
+    async def retrieve(self, query, top_k=5, cache=None):
+        """Embed the query and extract its filter concurrently, then query the index.
+
+        Filter extraction is best effort: if it fails or times out the search
+        runs unfiltered. With a cache, an exact hit short-circuits everything and
+        a semantic hit (same filter) short-circuits the index stage. With a lexical index, exact SKU/UPC mentions
+        short-circuit to those products and other results are fused with BM25
+        hits. With a structured catalog, aggregate and superlative questions are
+        answered exactly from it and skip embedding altogether.
+        Returns (contexts, embedding, cached_entry, summary, filter_dict).
+        """
+        lexical = self.lexical_index()
+        structured = self.catalog_query()
+
+        if cache is not None:
+            with telemetry.span("answer_cache"):
+                cached = cache.get(query)
+            if cached is not None:
+                telemetry.count("answer_cache_total", result="exact_hit")
+                return cached["contexts"], None, cached, None, None
+
+        # An exact SKU/UPC in the query goes straight to that product
+        if lexical is not None:
+            with telemetry.span("sku_lookup"):
+                exact = lexical.exact_matches(query)
+            if exact:
+                telemetry.count("retrieval_total", path="sku")
+                return exact[:top_k], None, None, None, None
+
+        if structured is not None:
+            with telemetry.span("structured_query"):
+                result = structured.answer(query)
+            if result is not None:
+                telemetry.count("retrieval_total", path="structured")
+                return result["rows"], None, None, result["summary"], None
+
+        embed_task = asyncio.ensure_future(asyncio.wait_for(self.embed_text(query), EMBED_TIMEOUT))
+        filter_task = asyncio.ensure_future(asyncio.wait_for(self.get_filter(query), FILTER_TIMEOUT))
+        try:
+            embedding = await embed_task
+        except (UpstreamUnavailable, TimeoutError) as e:
+            filter_task.cancel()
+            if lexical is None:
+                raise
+            # Embeddings are down: degrade to lexical search with the local filter
+            telemetry.error("embed", e)
+            telemetry.count("degraded_total", stage="embed")
+            print(f"Embedding unavailable, using lexical search only: {str(e)}")
+            filter_dict, _ = parse_filter(query)
+            with telemetry.span("lexical_search"):
+                contexts = [
+                    metadata for metadata, _ in
+                    lexical.search(query, top_k, predicate=lambda m: matches_filter(m, filter_dict))
+                ]
+            return contexts, None, None, None, filter_dict
+        except Exception:
+            filter_task.cancel()
+            raise
+
+        try:
+            filter_dict = await filter_task
+        except asyncio.TimeoutError as e:
+            telemetry.error("filter", e)
+            print("Filter extraction timed out; searching without a filter")
+            filter_dict = None
+
+        if cache is not None:
+            # Matched on the filter too: "under $20" and "under $30" embed almost alike
+            with telemetry.span("answer_cache"):
+                cached = cache.get(query, embedding, filter_dict)
+            if cached is not None:
+                telemetry.count("answer_cache_total", result="semantic_hit")
+                return cached["contexts"], embedding, cached, None, filter_dict
+            telemetry.count("answer_cache_total", result="miss")
+
+        if lexical is None:
+            telemetry.count("retrieval_total", path="vector")
+            contexts = await asyncio.wait_for(self.query_index(embedding, filter_dict, top_k), QUERY_TIMEOUT)
+            return contexts, embedding, None, None, filter_dict
+
+        # Hybrid: fuse dense results with BM25 hits that pass the same filter
+        telemetry.count("retrieval_total", path="hybrid")
+        dense = await asyncio.wait_for(self.query_index(embedding, filter_dict, top_k * 2), QUERY_TIMEOUT)
+        with telemetry.span("lexical_search"):
+            sparse = [
+                metadata for metadata, _ in
+                lexical.search(query, top_k * 2, predicate=lambda m: matches_filter(m, filter_dict))
+            ]
+        return reciprocal_rank_fusion([dense, sparse], top_k), embedding, None, None, filter_dict
+
+    async def search(self, query, top_k=5):
+        contexts, _, _, _, _ = await self.retrieve(query, top_k)
+        return contexts
+
+    async def ask_gpt(self, question, context, previous_answer, stats=None):
+        with telemetry.span("generate"):
+            response = await self._complete(build_answer_prompt(question, context, previous_answer), "answer")
+        if stats is not None:
+            stats["usage"] = response.usage
+        return response.choices[0].message.content
+
+    async def answer_turn(self, question, previous_answer="", top_k=5, mode="auto", stats=None):
+        """Run a whole chat turn under one deadline. Returns (contexts, answer).
+
+        mode="auto" answers lookups with product cards and everything else with
+        gpt-4o; mode="generate" always generates (the "tell me more" expansion).
+        How the answer was produced ends up in stats["mode"].
+        """
+        stats = {} if stats is None else stats
+        cache = self.cache_for(question, previous_answer, mode)
+        async with asyncio.timeout(TURN_DEADLINE):
+            contexts, embedding, cached, summary, filter_dict = await self.retrieve(question, top_k, cache)
+            if cached is not None:
+                self._answered(stats, "cached")
+                return contexts, cached["answer"]
+            if not contexts and not summary:
+                self._answered(stats, "empty")
+                return [], None
+            if self.use_template(question, previous_answer, contexts, summary, mode):
+                self._answered(stats, "template")
+                return contexts, render_cards(contexts, summary)
+            context, refs, accounting = build_context(contexts, summary)
+            try:
+                answer = await asyncio.wait_for(
+                    self.ask_gpt(question, context, previous_answer, stats), ANSWER_TIMEOUT
+                )
+            except (UpstreamUnavailable, TimeoutError) as e:
+                telemetry.error("generate", e)
+                self._answered(stats, "degraded")
+                return contexts, self.degraded_answer(question, embedding, contexts, summary, filter_dict)
+            self._answered(stats, "generated")
+            answer = refs.expand(answer)
+            log_token_usage(question, context, previous_answer, accounting, stats.get("usage"))
+            if cache is not None:
+                cache.put(question, embedding, answer, contexts, filter_dict)
+            return contexts, answer
+
+    @staticmethod
+    def _answered(stats, mode):
+        stats["mode"] = mode
+        telemetry.count("answers_total", mode=mode)
+
+    def degraded_answer(self, question, embedding, contexts, summary=None, filter_dict=None):
+        """An earlier answer to the same question if we have one, else a product list."""
+        telemetry.count("degraded_total", stage="generate")
+        if self.answer_cache is not None:
+            cached = self.answer_cache.get(question, embedding, filter_dict)
+            if cached is not None:
+                return cached["answer"]
+        return fallback_answer(contexts, summary)
+
+    async def stream_answer(self, question, context, previous_answer, stats):
+        """Yield gpt-4o answer chunks as they arrive; usage ends up in stats["usage"].
+
+        Identical concurrent prompts share one upstream stream.
+        """
+        prompt = build_answer_prompt(question, context, previous_answer)
+
+        async def open_stream():
+            stream = await self.chat.call(lambda: self.client.chat.completions.create(
+                model="gpt-4o",
+                messages=[{"role": "user", "content": prompt}],
+                stream=True,
+                stream_options={"include_usage": True}
+            ), tokens=estimate_tokens(prompt))
+            async for chunk in stream:
+                if chunk.usage:
+                    telemetry.record_usage(chunk.usage)
+                yield chunk
+
+        with telemetry.span("generate"):
+            async for chunk in self.chat.stream(open_stream, key=("answer", prompt)):
+                if chunk.usage:
+                    stats["usage"] = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async def stream_turn(self, question, previous_answer="", top_k=5, stats=None, mode="auto"):
+        """Run a chat turn and yield events as they become available.
+
+        Yields {"event": "contexts", ...} once retrieval is done, then
+        {"event": "delta", "text": ...} pieces of the answer (with URL
+        references already expanded), then {"event": "done", "answer": ...,
+        "mode": ...}. The answer is None when nothing relevant was found; mode
+        is as in answer_turn. Seconds to the first answer text and in total
+        end up in stats["ttft"]/["total"]. Consume it from a single task: the
+        generation timeout applies to it.
+        """
+        stats = {} if stats is None else stats
+        started = time.perf_counter()
+        cache = self.cache_for(question, previous_answer, mode)
+        contexts, embedding, cached, summary, filter_dict = await asyncio.wait_for(
+            self.retrieve(question, top_k, cache), TURN_DEADLINE
+        )
+        yield {"event": "contexts", "contexts": contexts, "summary": summary, "cached": cached is not None}
+
+        if cached is not None:
+            self._answered(stats, "cached")
+            stats["ttft"] = time.perf_counter() - started
+            yield {"event": "delta", "text": cached["answer"]}
+            yield {"event": "done", "answer": cached["answer"], "mode": "cached"}
+            return
+        if not contexts and not summary:
+            self._answered(stats, "empty")
+            yield {"event": "done", "answer": None, "mode": "empty"}
+            return
+        if self.use_template(question, previous_answer, contexts, summary, mode):
+            self._answered(stats, "template")
+            answer = render_cards(contexts, summary)
+            stats["ttft"] = stats["total"] = time.perf_counter() - started
+            yield {"event": "delta", "text": answer}
+            yield {"event": "done", "answer": answer, "mode": "template"}
+            return
+
+        context, refs, accounting = build_context(contexts, summary)
+        remaining = TURN_DEADLINE - (time.perf_counter() - started)
+        raw = ""
+        sent = 0
+        try:
+            async with asyncio.timeout(max(1.0, min(ANSWER_TIMEOUT, remaining))):
+                async for chunk in self.stream_answer(question, context, previous_answer, stats):
+                    raw += chunk
+                    # Hold back a trailing partial reference until the next chunk completes it
+                    partial = _PARTIAL_REF_RE.search(raw)
+                    expanded = refs.expand(raw[:partial.start()] if partial else raw)
+                    if len(expanded) > sent:
+                        if "ttft" not in stats:
+                            stats["ttft"] = time.perf_counter() - started
+                            telemetry.observe("ttft_seconds", stats["ttft"])
+                        yield {"event": "delta", "text": expanded[sent:]}
+                        sent = len(expanded)
+        except (UpstreamUnavailable, TimeoutError) as e:
+            telemetry.error("generate", e)
+            if sent:
+                raise
+            # Nothing shown yet, so an earlier or template answer can take its place
+            self._answered(stats, "degraded")
+            answer = self.degraded_answer(question, embedding, contexts, summary, filter_dict)
+            stats["total"] = time.perf_counter() - started
+            yield {"event": "delta", "text": answer}
+            yield {"event": "done", "answer": answer, "mode": "degraded"}
+            return
+        except Exception as e:
+            telemetry.error("generate", e)
+            raise
+        finally:
+            stats["total"] = time.perf_counter() - started
+
+        self._answered(stats, "generated")
+        answer = refs.expand(raw)
+        if len(answer) > sent:
+            yield {"event": "delta", "text": answer[sent:]}
+        log_token_usage(question, context, previous_answer, accounting, stats.get("usage"))
+        if cache is not None and answer:
+            cache.put(question, embedding, answer, contexts, filter_dict)
+        yield {"event": "done", "answer": answer, "mode": "generated"}
@@ -0,0 +1,287 @@
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from local_index import matches_filter
+
+EMBED_DIMENSION = 1536
+CANNED_ANSWER = (
+    "## 🧀 Cheese pick\n\n**Product:** {name}\n\nA creamy, well-balanced cheese that melts nicely "
+    "and pairs with crackers, fruit and a crisp white wine. "
+)
+
+
+class Faults:
+    """Latency, jitter and error injection shared by the fake services."""
+
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, token_latency=0.005, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.token_latency = token_latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def delay(self):
+        with self.lock:
+            self.requests += 1
+            seconds = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        time.sleep(max(0.0, seconds))
+
+    def should_fail(self):
+        with self.lock:
+            failed = self.random.random() < self.error_rate
+            self.errors += failed
+        return failed
+
+
+def fake_embedding(text, dimension=EMBED_DIMENSION):
+    """Deterministic unit vector for a text, so repeated queries hit the same neighbours."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    faults = None
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; with Nagle on, keep-alive
+    # clients stall on delayed ACKs (~40 ms) before seeing the body
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}") if length else {}
+
+    def _send(self, status, payload=None, headers=None):
+        data = json.dumps(payload if payload is not None else {}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _inject(self):
+        """Sleep for the configured latency; maybe answer with an injected error instead."""
+        self.faults.delay()
+        if self.faults.should_fail():
+            if self.faults.random.random() < 0.5:
+                self._send(429, {"error": {"message": "Rate limit reached (injected)", "type": "rate_limit"}},
+                           {"Retry-After": "1"})
+            else:
+                self._send(503, {"error": {"message": "Service unavailable (injected)", "type": "server_error"}})
+            return True
+        return False
+
+
+class FakeOpenAIHandler(_Handler):
+    """/v1/embeddings and /v1/chat/completions, including streamed completions."""
+
+    def do_POST(self):
+        body = self._body()
+        if self._inject():
+            return
+        if self.path.endswith("/embeddings"):
+            return self._embeddings(body)
+        if self.path.endswith("/chat/completions"):
+            return self._chat(body)
+        self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _embeddings(self, body):
+        texts = body["input"]
+        texts = [texts] if isinstance(texts, str) else texts
+        data = []
+        for i, text in enumerate(texts):
+            vector = fake_embedding(str(text))
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(str(t)) // 4 + 1 for t in texts)
+        self._send(200, {"object": "list", "model": body.get("model"), "data": data,
+                         "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    def _chat(self, body):
+        prompt = body["messages"][-1]["content"]
+        if "metadata filter" in prompt:
+            content = "{}"
+        else:
+            content = CANNED_ANSWER.format(name=prompt.split("User question:")[-1].strip()[:80])
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                 "total_tokens": (len(prompt) + len(content)) // 4}
+
+        if not body.get("stream"):
+            self._send(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model"), "usage": usage,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        base = {"id": "chatcmpl-fake", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": body.get("model")}
+        for word in content.split(" "):
+            chunk = dict(base, choices=[{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}])
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.faults.token_latency)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self.wfile.write(f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+class FakePineconeHandler(_Handler):
+    """Enough of the Pinecone control and data plane for ingest.py and engine.py.
+
+    One server plays both roles: describe_index reports the server itself as
+    the index host.
+    """
+
+    indexes = None
+    lock = None
+
+    def _index_model(self, name):
+        spec = self.indexes[name]
+        return {
+            "name": name, "dimension": spec["dimension"], "metric": spec["metric"],
+            "host": f"http://{self.server.server_address[0]}:{self.server.server_address[1]}",
+            "spec": {"serverless": {"cloud": "aws", "region": "us-east-1"}},
+            "status": {"ready": True, "state": "Ready"},
+            "deletion_protection": "disabled", "vector_type": "dense",
+        }
+
+    def _vectors(self):
+        # The benchmark uses a single index; data-plane calls go to the first one
+        return next(iter(self.indexes.values()))["vectors"] if self.indexes else {}
+
+    def do_GET(self):
+        if self._inject():
+            return
+        with self.lock:
+            if self.path.rstrip("/") == "/indexes":
+                return self._send(200, {"indexes": [self._index_model(n) for n in self.indexes]})
+            if self.path.startswith("/indexes/"):
+                name = self.path.split("/")[2]
+                if name in self.indexes:
+                    return self._send(200, self._index_model(name))
+                return self._send(404, {"error": {"code": "NOT_FOUND", "message": f"Index {name} not found"}})
+        self._send(404, {})
+
+    def do_DELETE(self):
+        if self._inject():
+            return
+        with self.lock:
+            if self.path.startswith("/indexes/"):
+                self.indexes.pop(self.path.split("/")[2], None)
+                return self._send(202, {})
+        self._send(404, {})
+
+    def do_POST(self):
+        body = self._body()
+        if self._inject():
+            return
+        with self.lock:
+            if self.path.rstrip("/") == "/indexes":
+                self.indexes[body["name"]] = {"dimension": body["dimension"],
+                                              "metric": body.get("metric", "cosine"), "vectors": {}}
+                return self._send(201, self._index_model(body["name"]))
+            vectors = self._vectors()
+            if self.path == "/vectors/upsert":
+                for item in body.get("vectors", []):
+                    vectors[item["id"]] = (np.asarray(item["values"], dtype=np.float32), item.get("metadata") or {})
+                return self._send(200, {"upsertedCount": len(body.get("vectors", []))})
+            if self.path == "/vectors/delete":
+                for item_id in body.get("ids", []):
+                    vectors.pop(item_id, None)
+                return self._send(200, {})
+            if self.path == "/describe_index_stats":
+                dimension = next(iter(self.indexes.values()))["dimension"] if self.indexes else 0
+                return self._send(200, {"namespaces": {"": {"vectorCount": len(vectors)}},
+                                        "dimension": dimension, "indexFullness": 0.0,
+                                        "totalVectorCount": len(vectors)})
+            if self.path == "/query":
+                return self._send(200, self._query(body, vectors))
+        self._send(404, {})
+
+    @staticmethod
+    def _query(body, vectors):
+        query = np.asarray(body["vector"], dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        scored = []
+        for item_id, (vector, metadata) in vectors.items():
+            if matches_filter(metadata, body.get("filter")):
+                score = float(vector @ query / (np.linalg.norm(vector) or 1.0))
+                scored.append((score, item_id, metadata))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        matches = []
+        for score, item_id, metadata in scored[:body.get("topK", 10)]:
+            match = {"id": item_id, "score": score}
+            if body.get("includeMetadata"):
+                match["metadata"] = metadata
+            matches.append(match)
+        return {"matches": matches, "namespace": body.get("namespace", "")}
+
+
+def _serve(handler, faults, port, **attributes):
+    handler_class = type(handler.__name__, (handler,), dict(faults=faults, **attributes))
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name=handler.__name__).start()
+    return server
+
+
+def start_fake_openai(faults=None, port=0):
+    """Start the fake OpenAI API; its base URL is http://127.0.0.1:<port>/v1."""
+    return _serve(FakeOpenAIHandler, faults or Faults(), port)
+
+
+def start_fake_pinecone(faults=None, port=0):
+    """Start the fake Pinecone API on http://127.0.0.1:<port>."""
+    return _serve(FakePineconeHandler, faults or Faults(), port, indexes={}, lock=threading.Lock())
+
+
+def server_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run local stand-ins for the OpenAI and Pinecone APIs")
+    parser.add_argument("--openai-port", type=int, default=8765)
+    parser.add_argument("--pinecone-port", type=int, default=8766)
+    parser.add_argument("--latency", type=float, default=0.05, help="Base seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Uniform +/- seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429/503")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="Seconds between streamed chunks")
+    args = parser.parse_args()
+
+    faults = Faults(args.latency, args.jitter, args.error_rate, args.token_latency)
+    openai_server = start_fake_openai(faults, args.openai_port)
+    pinecone_server = start_fake_pinecone(faults, args.pinecone_port)
+    print(f"OPENAI_BASE_URL={server_url(openai_server)}/v1")
+    print(f"PINECONE_HOST={server_url(pinecone_server)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
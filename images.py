@@ -0,0 +1,150 @@
+import os
+import io
+import json
+import asyncio
+import hashlib
+import mimetypes
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+import httpx
+from PIL import Image
+
+IMAGES_DIR = "downloaded_images"
+# Under static/ so Streamlit serves thumbnails as cacheable files (server.enableStaticServing)
+STATIC_DIR = "static"
+THUMBS_DIR = os.path.join(STATIC_DIR, "thumbs")
+IMAGE_INDEX_PATH = os.path.join(IMAGES_DIR, "image_index.json")
+
+IMAGE_FETCH_CONCURRENCY = int(os.getenv("IMAGE_FETCH_CONCURRENCY", "8"))
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+# Width requested from the shop's Next.js image renderer instead of w=3840
+IMAGE_SOURCE_WIDTH = int(os.getenv("IMAGE_SOURCE_WIDTH", "640"))
+
+
+def source_image_url(image_url, width=IMAGE_SOURCE_WIDTH):
+    """Ask the shop's /_next/image renderer for a smaller rendition of the image."""
+    parsed = urlparse(image_url)
+    if not parsed.path.endswith("/_next/image"):
+        return image_url
+    params = parse_qs(parsed.query)
+    params["w"] = [str(width)]
+    return urlunparse(parsed._replace(query=urlencode(params, doseq=True)))
+
+
+def load_image_index(path=IMAGE_INDEX_PATH):
+    """Load {image_url: record} with cache validators, content hash and file paths."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_image_index(index, path=IMAGE_INDEX_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def _store_image(content, content_type):
+    """Write the image and its thumbnail under content-hash names; duplicates are free."""
+    digest = hashlib.sha256(content).hexdigest()
+    name = digest[:20]
+    extension = mimetypes.guess_extension((content_type or "").split(";")[0].strip()) or ".jpg"
+    image_path = os.path.join(IMAGES_DIR, name + extension)
+    thumb_path = os.path.join(THUMBS_DIR, name + ".jpg")
+
+    if not os.path.exists(image_path):
+        with open(image_path, "wb") as f:
+            f.write(content)
+    if not os.path.exists(thumb_path):
+        image = Image.open(io.BytesIO(content))
+        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        if image.mode != "RGB":
+            # Flatten transparency onto white so JPEG thumbnails look right
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.convert("RGBA").getchannel("A"))
+            image = background
+        image.save(thumb_path, "JPEG", quality=80, optimize=True)
+    return digest, image_path, thumb_path
+
+
+async def fetch_image(client, semaphore, image_url, index):
+    """Fetch one image with a conditional GET; returns its index record or None."""
+    record = index.get(image_url)
+    headers = {}
+    thumbnail = (record or {}).get("thumbnail", "")
+    # Thumbnails from before they moved under static/ are fetched again
+    if os.path.dirname(thumbnail) == THUMBS_DIR and os.path.exists(thumbnail):
+        if record.get("etag"):
+            headers["If-None-Match"] = record["etag"]
+        if record.get("last_modified"):
+            headers["If-Modified-Since"] = record["last_modified"]
+
+    try:
+        async with semaphore:
+            response = await client.get(source_image_url(image_url), headers=headers)
+        if response.status_code == 304:
+            return record
+        response.raise_for_status()
+
+        digest, image_path, thumb_path = await asyncio.to_thread(
+            _store_image, response.content, response.headers.get("content-type")
+        )
+        record = {
+            "sha256": digest,
+            "path": image_path,
+            "thumbnail": thumb_path,
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+        }
+        index[image_url] = record
+        return record
+    except Exception as e:
+        print(f"Failed to download {image_url}: {e}")
+        return record
+
+
+async def fetch_images(image_urls, index=None):
+    """Fetch many images concurrently. Returns {image_url: record} for successes."""
+    os.makedirs(THUMBS_DIR, exist_ok=True)
+    index = load_image_index() if index is None else index
+    urls = sorted({url for url in image_urls if url and url.startswith("http")})
+    semaphore = asyncio.Semaphore(IMAGE_FETCH_CONCURRENCY)
+    limits = httpx.Limits(max_connections=IMAGE_FETCH_CONCURRENCY)
+    async with httpx.AsyncClient(timeout=20, limits=limits, follow_redirects=True) as client:
+        records = await asyncio.gather(*(fetch_image(client, semaphore, url, index) for url in urls))
+    save_image_index(index)
+    return {url: record for url, record in zip(urls, records) if record}
+
+
+def fetch_product_images(cheeses):
+    """Download images for scraped products and set each product's thumbnail image_path."""
+    records = asyncio.run(fetch_images(cheese.get("image_url") for cheese in cheeses))
+    for cheese in cheeses:
+        record = records.get(cheese.get("image_url"))
+        cheese["image_path"] = record["thumbnail"] if record else "N/A"
+    print(f"Fetched images for {len(records)} of {len(cheeses)} products")
+    return cheeses
+
+
+def thumbnail_map(path=IMAGE_INDEX_PATH):
+    """Map remote image URLs to local thumbnail paths (served from static/)."""
+    return {
+        url: record["thumbnail"]
+        for url, record in load_image_index(path).items()
+        if os.path.dirname(record.get("thumbnail") or "") == THUMBS_DIR and os.path.exists(record["thumbnail"])
+    }
+
+
+def thumbnail_url(thumbnail_path):
+    """The URL Streamlit's static file serving gives a thumbnail."""
+    return "app/" + thumbnail_path.replace(os.sep, "/")
+
+
+if __name__ == "__main__":
+    from catalog_store import load_catalog, write_catalog
+    cheeses = list(load_catalog())
+    fetch_product_images(cheeses)
+    write_catalog(cheeses)
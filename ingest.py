@@ -1,17 +1,37 @@
 import os
 import json
+import time
+import queue
+import threading
+import hashlib
+import argparse
+import numpy as np
+import pyarrow as pa
 from pinecone import Pinecone
 from openai import OpenAI
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from local_index import LocalIndex, write_local_index
+from lexical_index import LEXICAL_INDEX_PATH, write_lexical_index
+from rate_limiter import RateLimiter, estimate_tokens
+from catalog_version import publish_catalog_version, read_catalog_version
+from catalog_store import catalog_path, load_catalog
+from embeddings import EMBED_MODEL, EmbeddingCache, embed_texts as shared_embed_texts
+import telemetry
 
 # Load environment variables
 load_dotenv()
 
+# Vector backend: "pinecone" (default) or "local" (in-process NumPy index only)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone").lower()
+
 # API Keys
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+# Optional control-plane host override (e.g. Pinecone Local or fake_services.py)
+PINECONE_HOST = os.getenv("PINECONE_HOST")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-if not PINECONE_API_KEY or not OPENAI_API_KEY:
+if not OPENAI_API_KEY or (VECTOR_BACKEND == "pinecone" and not PINECONE_API_KEY):
     raise ValueError("Missing required API keys. Please check your .env file.")
 
 # Initialize OpenAI
@@ -20,110 +40,421 @@ try:
 except Exception as e:
     raise Exception(f"Failed to initialize OpenAI client: {str(e)}")
 
-# Initialize Pinecone
-try:
-    pc = Pinecone(api_key=PINECONE_API_KEY)
-except Exception as e:
-    raise Exception(f"Failed to initialize Pinecone client: {str(e)}")
-
 # Index name and configuration
 index_name = "cheese-knowledge"
 dimension = 1536  # Dimension for text-embedding-3-small
+index = None
+pc = None
 
-# Get or create the index
-try:
-    # Check if index exists
-    existing_indexes = pc.list_indexes()
-    if index_name in [index.name for index in existing_indexes]:
-        # Delete existing index
-        pc.delete_index(index_name)
-        print(f"Deleted existing index: {index_name}")
-    
-    # Create new index with correct dimension
-    pc.create_index(
-        name=index_name,
-        dimension=dimension,
-        metric="cosine",
-        spec=dict(
-            serverless=dict(
-                cloud="aws",
-                region="us-east-1"
+# Content hashes of the last ingested products, keyed by SKU
+MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", "ingest_manifest.json")
+
+if VECTOR_BACKEND == "pinecone":
+    # Initialize Pinecone
+    try:
+        pc = Pinecone(api_key=PINECONE_API_KEY, host=PINECONE_HOST)
+    except Exception as e:
+        raise Exception(f"Failed to initialize Pinecone client: {str(e)}")
+
+def setup_index(full_rebuild=False):
+    """Get the Pinecone index, creating it if needed.
+
+    Only a full rebuild deletes an existing index; incremental runs keep
+    serving the current one while it is updated in place.
+    """
+    global index
+    if pc is None:
+        return None
+    try:
+        # Check if index exists
+        existing_indexes = [existing.name for existing in pc.list_indexes()]
+        if index_name in existing_indexes and full_rebuild:
+            # Delete existing index
+            pc.delete_index(index_name)
+            existing_indexes.remove(index_name)
+            print(f"Deleted existing index: {index_name}")
+
+        if index_name not in existing_indexes:
+            # Create new index with correct dimension
+            pc.create_index(
+                name=index_name,
+                dimension=dimension,
+                metric="cosine",
+                spec=dict(
+                    serverless=dict(
+                        cloud="aws",
+                        region="us-east-1"
+                    )
+                )
             )
+            print(f"Created new index: {index_name} with dimension {dimension}")
+
+        # Get the index
+        index = pc.Index(index_name)
+        return index
+    except Exception as e:
+        raise Exception(f"Failed to setup Pinecone index: {str(e)}")
+
+# Batching and rate-limit configuration
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "100"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "4"))
+EMBED_RPM = int(os.getenv("EMBED_RPM", "3000"))
+EMBED_TPM = int(os.getenv("EMBED_TPM", "1000000"))
+
+rate_limiter = RateLimiter(rpm=EMBED_RPM, tpm=EMBED_TPM)
+embedding_cache = EmbeddingCache()
+
+# Micro-batching for StreamIngestor
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "20"))
+STREAM_FLUSH_SECONDS = float(os.getenv("STREAM_FLUSH_SECONDS", "10"))
+_STREAM_DONE = object()
+
+REQUIRED_FIELDS = ['product_name', 'company_name', 'price', 'Unit',
+                   'Cost per pound', 'standard', 'weight(pound)', 'SKU', 'UPC']
+
+def embed_texts(texts):
+    """Generate embeddings for a batch of texts, requesting only uncached ones from OpenAI."""
+    try:
+        return shared_embed_texts(
+            client, texts, model=EMBED_MODEL, cache=embedding_cache,
+            before_request=lambda batch: rate_limiter.acquire(tokens=sum(estimate_tokens(t) for t in batch))
         )
-    )
-    print(f"Created new index: {index_name} with dimension {dimension}")
-    
-    # Get the index
-    index = pc.Index(index_name)
-except Exception as e:
-    raise Exception(f"Failed to setup Pinecone index: {str(e)}")
+    except Exception as e:
+        raise Exception(f"Failed to generate embeddings: {str(e)}")
 
 def embed_text(text):
     """Generate embedding for the given text using OpenAI."""
+    return embed_texts([text])[0]
+
+def build_context(cheese):
+    """Create the context string that gets embedded for a cheese product."""
+    return f"product_name: {cheese['product_name']}. company_name: {cheese['company_name']}. \
+                    Price: {cheese['price']}. Unit: {cheese['Unit']}. Cost per pound: {cheese['Cost per pound']}. \
+                        Standard: {cheese['standard']}. Weight: {cheese['weight(pound)']}. SKU: {cheese['SKU']}. UPC: {cheese['UPC']}. image_url: {cheese['image_url']}"
+
+def chunked(items, size):
+    """Split a list into consecutive chunks of at most `size` items."""
+    return [items[i:i + size] for i in range(0, len(items), max(1, size))]
+
+def embed_batch(batch):
+    """Embed a batch of (id, context, cheese) items, isolating per-item failures.
+
+    If the batch request fails, each item is retried on its own so a single
+    bad product only loses itself.
+    """
+    try:
+        with telemetry.span("embed_batch"):
+            embeddings = embed_texts([context for _, context, _ in batch])
+        return [(item_id, embedding, cheese) for (item_id, _, cheese), embedding in zip(batch, embeddings)]
+    except Exception as batch_error:
+        telemetry.error("embed_batch", batch_error)
+        print(f"Batch embedding failed, retrying items individually: {str(batch_error)}")
+
+    results = []
+    for item_id, context, cheese in batch:
+        telemetry.count("retries_total", stage="embed_item")
+        try:
+            results.append((item_id, embed_text(context), cheese))
+        except Exception as item_error:
+            telemetry.error("embed_item", item_error)
+            print(f"Error embedding cheese {item_id}: {str(item_error)}")
+    return results
+
+def upsert_vectors(vectors):
+    """Upsert vectors to Pinecone in chunks, falling back to single upserts on failure.
+
+    Returns the ids that were uploaded.
+    """
+    uploaded = []
+    for chunk in chunked(vectors, UPSERT_BATCH_SIZE):
+        try:
+            with telemetry.span("upsert"):
+                index.upsert(chunk)
+            uploaded.extend(vector["id"] for vector in chunk)
+        except Exception as chunk_error:
+            telemetry.error("upsert", chunk_error)
+            print(f"Bulk upsert failed, retrying items individually: {str(chunk_error)}")
+            for vector in chunk:
+                telemetry.count("retries_total", stage="upsert_item")
+                try:
+                    index.upsert([vector])
+                    uploaded.append(vector["id"])
+                except Exception as item_error:
+                    telemetry.error("upsert_item", item_error)
+                    print(f"Error uploading cheese {vector['id']}: {str(item_error)}")
+    return uploaded
+
+def content_hash(context, cheese):
+    """Hash of everything stored for a product: its context string and metadata."""
+    payload = context + json.dumps(cheese, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def load_manifest():
+    """Load the {sku: content hash} manifest from the previous run."""
     try:
-        response = client.embeddings.create(
-            input=[text],
-            model="text-embedding-3-small"  # Using 3-small which has 1536 dimensions
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except json.JSONDecodeError:
+        print(f"Ignoring corrupt manifest {MANIFEST_PATH}; re-ingesting everything")
+        return {}
+
+def save_manifest(manifest):
+    tmp_path = f"{MANIFEST_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def stale_ids(manifest, local_vectors, keep):
+    """Ids in the manifest or the local index that are not in keep.
+
+    The local index can hold ids the manifest never saw, such as the positional
+    ids written before vectors were keyed by SKU.
+    """
+    return [item_id for item_id in dict.fromkeys([*manifest, *local_vectors]) if item_id not in keep]
+
+def load_local_vectors():
+    """Return {id: (vector, metadata)} from the existing local index, if any."""
+    try:
+        local = LocalIndex(quantization="none")
+    except Exception:
+        return {}
+    # Copy out of the memory map so the index file can be replaced afterwards
+    vectors = np.array(local.vectors)
+    return {
+        item_id: (vectors[row], local.metadata[row])
+        for row, item_id in enumerate(local.ids)
+    }
+
+def delete_vectors(ids):
+    """Delete vectors from Pinecone in chunks; returns the ids actually removed."""
+    deleted = []
+    for chunk in chunked(ids, UPSERT_BATCH_SIZE):
+        try:
+            with telemetry.span("delete"):
+                index.delete(ids=chunk)
+            deleted.extend(chunk)
+        except Exception as delete_error:
+            telemetry.error("delete", delete_error)
+            print(f"Error deleting cheeses {chunk}: {str(delete_error)}")
+    return deleted
+
+def prepare_items(cheeses):
+    """Validate each cheese and build its context string and content hash, keyed by SKU."""
+    current = {}
+    for i, cheese in enumerate(cheeses):
+        try:
+            for field in REQUIRED_FIELDS:
+                if field not in cheese:
+                    raise ValueError(f"Missing required field '{field}' in cheese data at index {i}")
+            item_id = str(cheese['SKU'])
+            if item_id in current:
+                print(f"Duplicate SKU {item_id} at index {i}; keeping the later entry")
+            context = build_context(cheese)
+            current[item_id] = (context, cheese, content_hash(context, cheese))
+        except Exception as cheese_error:
+            print(f"Error processing cheese at index {i}: {str(cheese_error)}")
+            continue
+    return current
+
+def index_items(current, manifest, local_vectors):
+    """Embed and upsert new or changed items; returns how many landed.
+
+    manifest and local_vectors are updated in place, and only for items that
+    were actually uploaded, so failures are retried on the next run.
+    """
+    # Only new or changed products need embedding (and anything missing locally)
+    items = [
+        (item_id, context, cheese)
+        for item_id, (context, cheese, digest) in current.items()
+        if manifest.get(item_id) != digest or item_id not in local_vectors
+    ]
+    if not items:
+        return 0
+
+    # Embed batches concurrently; the rate limiter keeps us under RPM/TPM
+    embedded = []
+    batches = chunked(items, EMBED_BATCH_SIZE)
+    with ThreadPoolExecutor(max_workers=EMBED_WORKERS) as executor:
+        for done, results in enumerate(executor.map(embed_batch, batches), start=1):
+            embedded.extend(results)
+            print(f"Embedded batch {done} of {len(batches)} ({len(embedded)} of {len(items)} cheeses)")
+
+    # Upload to Pinecone
+    uploaded_ids = {item_id for item_id, _, _ in embedded}
+    if index is not None:
+        vectors = [
+            {"id": item_id, "values": embedding, "metadata": cheese}
+            for item_id, embedding, cheese in embedded
+        ]
+        uploaded_ids = set(upsert_vectors(vectors))
+        print(f"Uploaded {len(uploaded_ids)} of {len(items)} cheeses")
+
+    for item_id, embedding, cheese in embedded:
+        if item_id in uploaded_ids:
+            manifest[item_id] = current[item_id][2]
+            local_vectors[item_id] = (embedding, cheese)
+    return len(uploaded_ids)
+
+def remove_items(removed, manifest, local_vectors):
+    """Delete products that are no longer listed; returns the ids removed."""
+    if index is not None and removed:
+        removed = delete_vectors(removed)
+        print(f"Deleted {len(removed)} cheeses that are no longer listed")
+    for item_id in removed:
+        manifest.pop(item_id, None)
+        local_vectors.pop(item_id, None)
+    return removed
+
+def publish(manifest, local_vectors, changed):
+    """Write the local index and manifest, and publish a new catalog version if anything changed."""
+    # Write the memory-mappable local index used by VECTOR_BACKEND=local
+    if local_vectors and changed:
+        write_local_index(
+            list(local_vectors),
+            [vector for vector, _ in local_vectors.values()],
+            [cheese for _, cheese in local_vectors.values()],
         )
-        return response.data[0].embedding
-    except Exception as e:
-        raise Exception(f"Failed to generate embedding: {str(e)}")
+        print(f"Wrote local index with {len(local_vectors)} vectors")
+    if local_vectors and (changed or not os.path.exists(LEXICAL_INDEX_PATH)):
+        write_lexical_index([cheese for _, cheese in local_vectors.values()])
+        print(f"Wrote lexical index with {len(local_vectors)} products")
+    save_manifest(manifest)
+
+    # A new catalog version invalidates the chatbot's answer cache
+    if changed or read_catalog_version() is None:
+        print(f"Published catalog version {publish_catalog_version(manifest)}")
+
+def ingest(full_rebuild=False):
+    """Ingest cheese data into Pinecone.
 
-def ingest():
-    """Ingest cheese data into Pinecone."""
+    By default only new or changed products (by content hash, keyed by SKU)
+    are embedded and upserted, and products that disappeared are deleted.
+    With full_rebuild=True the index is recreated and everything re-embedded.
+    """
     try:
-        # Load cheese data
+        # Load cheese data (the Arrow catalog, or cheese_data.json if that is newer)
+        path = catalog_path()
         try:
-            with open("cheese_data.json", "r", encoding="utf-8") as f:
-                cheeses = json.load(f)
+            with telemetry.span("load_catalog"):
+                cheeses = load_catalog(path)
         except FileNotFoundError:
-            raise Exception("cheese_data.json file not found")
-        except json.JSONDecodeError:
-            raise Exception("Invalid JSON format in cheese_data.json")
-        
-        print(f"Loaded {len(cheeses)} cheese products from cheese_data.json")
-        
-        # Process each cheese
-        for i, cheese in enumerate(cheeses):
-            try:
-                # Validate required fields
-                required_fields = ['product_name', 'company_name', 'price', 'Unit', 
-                                 'Cost per pound', 'standard', 'weight(pound)', 'SKU', 'UPC']
-                for field in required_fields:
-                    if field not in cheese:
-                        raise ValueError(f"Missing required field '{field}' in cheese data at index {i}")
-                
-                # Create context string
-                context = f"product_name: {cheese['product_name']}. company_name: {cheese['company_name']}. \
-                    Price: {cheese['price']}. Unit: {cheese['Unit']}. Cost per pound: {cheese['Cost per pound']}. \
-                        Standard: {cheese['standard']}. Weight: {cheese['weight(pound)']}. SKU: {cheese['SKU']}. UPC: {cheese['UPC']}. image_url: {cheese['image_url']}"
-                
-                # Get embedding
-                embedding = embed_text(context)
-                
-                # Upload to Pinecone
-                index.upsert([
-                    {
-                        "id": str(i),
-                        "values": embedding,
-                        "metadata": cheese
-                    }
-                ])
-                print(f"Uploaded cheese {i+1} of {len(cheeses)}")
-                
-            except Exception as cheese_error:
-                print(f"Error processing cheese at index {i}: {str(cheese_error)}")
-                continue
+            raise Exception(f"{path} file not found")
+        except (json.JSONDecodeError, pa.ArrowInvalid):
+            raise Exception(f"Invalid catalog format in {path}")
         
+        print(f"Loaded {len(cheeses)} cheese products from {path}")
+
+        manifest = {} if full_rebuild else load_manifest()
+        if not full_rebuild and not manifest:
+            # Without a manifest we can't tell which vectors in the index are ours
+            # (e.g. positional ids from before SKU keys), so start from scratch
+            print(f"No manifest at {MANIFEST_PATH}; doing a full rebuild")
+            full_rebuild = True
+        setup_index(full_rebuild)
+        local_vectors = {} if full_rebuild else load_local_vectors()
+
+        current = prepare_items(cheeses)
+        removed = stale_ids(manifest, local_vectors, current)
+
+        landed = index_items(current, manifest, local_vectors)
+        removed = remove_items(removed, manifest, local_vectors)
+        telemetry.count("products_indexed_total", landed)
+        telemetry.count("products_removed_total", len(removed))
+        print(f"{landed} new or changed, {len(removed)} removed, "
+              f"{len(current) - landed} unchanged or failed")
+
+        with telemetry.span("publish"):
+            publish(manifest, local_vectors, changed=bool(landed or removed))
+
+        print(f"Embedding cache: {embedding_cache.stats()}")
         print("Ingestion completed successfully!")
     
     except Exception as e:
+        telemetry.error("ingest", e)
         print(f"An error occurred during ingestion: {str(e)}")
         raise
+    finally:
+        telemetry.write_textfile()
+
+class StreamIngestor:
+    """Consume products while they are being scraped and index them in micro-batches.
+
+    submit() is called from scraper threads; a single consumer thread flushes
+    a batch every STREAM_BATCH_SIZE products or STREAM_FLUSH_SECONDS, saving
+    the manifest after each flush as a checkpoint. close() drains the queue
+    and, after a complete crawl, deletes products that were not seen.
+    """
+
+    def __init__(self, batch_size=None, flush_seconds=None):
+        self.batch_size = batch_size or STREAM_BATCH_SIZE
+        self.flush_seconds = flush_seconds or STREAM_FLUSH_SECONDS
+        self.manifest = load_manifest()
+        # As in ingest(): without a manifest, rebuild rather than keep vectors we can't account for
+        full_rebuild = not self.manifest
+        setup_index(full_rebuild)
+        self.local_vectors = {} if full_rebuild else load_local_vectors()
+        self.landed = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="stream-ingest")
+        self.thread.start()
+
+    def submit(self, cheese):
+        self.queue.put(cheese)
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_seconds
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            finished = item is _STREAM_DONE
+            if item is not None and not finished:
+                batch.append(item)
+            if batch and (finished or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+            if finished:
+                return
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_seconds
+
+    def _flush(self, batch):
+        try:
+            with telemetry.span("stream_flush"):
+                landed = index_items(prepare_items(batch), self.manifest, self.local_vectors)
+            self.landed += landed
+            telemetry.count("products_indexed_total", landed)
+            # Checkpoint so a restarted run does not re-embed what already landed
+            save_manifest(self.manifest)
+            print(f"Streamed {landed} of {len(batch)} cheeses into the index")
+        except Exception as e:
+            telemetry.error("stream_flush", e)
+            print(f"Error ingesting streamed batch: {str(e)}")
+
+    def close(self, seen_skus=None):
+        """Finish ingesting; pass the SKUs of a complete crawl to delete vanished products."""
+        self.queue.put(_STREAM_DONE)
+        self.thread.join()
+        removed = []
+        if seen_skus is not None:
+            seen = {str(sku) for sku in seen_skus}
+            removed = remove_items(stale_ids(self.manifest, self.local_vectors, seen),
+                                   self.manifest, self.local_vectors)
+        publish(self.manifest, self.local_vectors, changed=bool(self.landed or removed))
+        print(f"Stream ingestion finished: {self.landed} indexed, {len(removed)} removed")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest the cheese catalog into the vector index")
+    parser.add_argument("--full", action="store_true",
+                        help="Delete and recreate the index and re-embed every product")
+    args = parser.parse_args()
     try:
-        ingest()
+        ingest(full_rebuild=args.full)
     except Exception as e:
         print(f"Fatal error: {str(e)}")
-        exit(1)
\ No newline at end of file
+        exit(1)
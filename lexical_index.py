@@ -0,0 +1,119 @@
+import os
+import re
+import json
+import math
+from collections import Counter, defaultdict
+
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "lexical_index.json")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Reciprocal-rank fusion constant
+RRF_K = 60
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_CODE_RE = re.compile(r"\b\d{5,}\b")
+_STOPWORDS = {"the", "a", "an", "of", "for", "me", "show", "what", "is", "are", "and",
+              "or", "in", "by", "with", "to", "do", "you", "have", "any", "price", "cheese"}
+
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall(str(text).lower()) if t not in _STOPWORDS]
+
+
+def code_text(value):
+    """A SKU/UPC as text; Pinecone returns numeric metadata as floats (124254.0 -> "124254")."""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def product_key(metadata):
+    return code_text(metadata["SKU"])
+
+
+def _document_text(metadata):
+    return " ".join(code_text(metadata.get(field, "")) for field in ("product_name", "company_name", "SKU", "UPC"))
+
+
+def write_lexical_index(products, path=LEXICAL_INDEX_PATH):
+    """Build the BM25 postings and SKU/UPC lookup for the catalog and save them."""
+    docs = []
+    postings = defaultdict(list)
+    codes = {}
+    for product in products:
+        key = product_key(product)
+        doc_id = len(docs)
+        terms = Counter(tokenize(_document_text(product)))
+        docs.append({"key": key, "length": sum(terms.values()), "metadata": product})
+        for term, tf in terms.items():
+            postings[term].append([doc_id, tf])
+        for field in ("SKU", "UPC"):
+            if product.get(field) not in (None, "", "N/A"):
+                codes[code_text(product[field])] = doc_id
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"docs": docs, "postings": postings, "codes": codes}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class LexicalIndex:
+    """In-memory BM25 index over product name, company, SKU and UPC."""
+
+    def __init__(self, path=LEXICAL_INDEX_PATH):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise Exception(f"Lexical index not found at {path}. Run ingest.py first.")
+        self.docs = data["docs"]
+        self.postings = data["postings"]
+        self.codes = data["codes"]
+        self.avg_length = (sum(d["length"] for d in self.docs) / len(self.docs)) if self.docs else 0.0
+        self.idf = {
+            term: math.log(1 + (len(self.docs) - len(plist) + 0.5) / (len(plist) + 0.5))
+            for term, plist in self.postings.items()
+        }
+
+    def exact_matches(self, query):
+        """Products whose SKU or UPC appears verbatim in the query."""
+        hits = []
+        for code in _CODE_RE.findall(query):
+            doc_id = self.codes.get(code)
+            if doc_id is not None and self.docs[doc_id]["metadata"] not in hits:
+                hits.append(self.docs[doc_id]["metadata"])
+        return hits
+
+    def search(self, query, top_k=10, predicate=None):
+        """BM25 top-k as a list of (metadata, score); predicate filters candidates."""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            for doc_id, tf in self.postings.get(term, ()):
+                length = self.docs[doc_id]["length"]
+                norm = tf + K1 * (1 - B + B * length / (self.avg_length or 1))
+                scores[doc_id] += self.idf[term] * tf * (K1 + 1) / norm
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        results = []
+        for doc_id, score in ranked:
+            metadata = self.docs[doc_id]["metadata"]
+            if predicate is None or predicate(metadata):
+                results.append((metadata, score))
+                if len(results) >= top_k:
+                    break
+        return results
+
+
+def reciprocal_rank_fusion(result_lists, top_k, k=RRF_K):
+    """Fuse ranked lists of product metadata by reciprocal rank, keyed by SKU."""
+    scores = defaultdict(float)
+    products = {}
+    for results in result_lists:
+        for rank, metadata in enumerate(results):
+            key = product_key(metadata)
+            scores[key] += 1.0 / (k + rank + 1)
+            products.setdefault(key, metadata)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [products[key] for key in ranked[:top_k]]
@@ -0,0 +1,375 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+# Default location of the on-disk local index (without extension)
+LOCAL_INDEX_PATH = os.getenv("LOCAL_INDEX_PATH", "cheese_vectors")
+# Compressed search tier kept in memory: "none", "int8" (4x smaller) or "binary" (32x smaller).
+# Candidates found on the codes are re-ranked with the memory-mapped float vectors.
+LOCAL_INDEX_QUANTIZATION = os.getenv("LOCAL_INDEX_QUANTIZATION", "none").lower()
+# Candidates per requested result that get the exact float re-rank
+LOCAL_INDEX_RERANK_FACTOR = int(os.getenv("LOCAL_INDEX_RERANK_FACTOR", "10"))
+
+QUANTIZATION_MODES = ("none", "int8", "binary")
+# Rows scored per block in the coarse search; small blocks stay in CPU cache
+_SCAN_ROWS = 512
+
+
+def _hamming(codes, query_bits):
+    """Differing bits between each row of packed codes and the packed query."""
+    if codes.shape[1] % 8 == 0:
+        # Compare 64 bits at a time
+        codes, query_bits = codes.view(np.uint64), query_bits.view(np.uint64)
+    return np.bitwise_count(codes ^ query_bits).sum(axis=1, dtype=np.int32)
+
+_RANGE_OPS = {
+    "$gt": np.greater,
+    "$gte": np.greater_equal,
+    "$lt": np.less,
+    "$lte": np.less_equal,
+}
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _value_matches(value, op, target):
+    if op == "$eq":
+        return value == target
+    if op == "$ne":
+        return value != target
+    if op in _RANGE_OPS:
+        return _is_number(value) and bool(_RANGE_OPS[op](float(value), float(target)))
+    if op == "$in":
+        return value in target
+    if op == "$nin":
+        return value not in target
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+
+def matches_filter(metadata, filter_dict):
+    """Evaluate a Pinecone-style metadata filter against a single metadata dict."""
+    if not filter_dict:
+        return True
+    for key, condition in filter_dict.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        else:
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, target in condition.items():
+                if op == "$exists":
+                    if (key in metadata) != bool(target):
+                        return False
+                elif key not in metadata or not _value_matches(metadata[key], op, target):
+                    return False
+    return True
+
+
+def quantize_int8(matrix):
+    """Symmetric per-dimension int8 codes, and the scales that map them back to floats."""
+    scales = np.abs(matrix).max(axis=0) / 127.0 if len(matrix) else np.ones(matrix.shape[1])
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scales), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(matrix, center):
+    """One bit per dimension (above or below the corpus mean), packed 8 to a byte.
+
+    Embeddings are not centred on the origin, so comparing against the mean
+    keeps the bits informative.
+    """
+    return np.packbits(matrix > center, axis=1)
+
+
+def _quantize(matrix, mode):
+    if mode == "int8":
+        codes, scales = quantize_int8(matrix)
+        return {"codes": codes, "scales": scales}
+    center = matrix.mean(axis=0).astype(np.float32) if len(matrix) else np.zeros(matrix.shape[1], np.float32)
+    return {"codes": quantize_binary(matrix, center), "center": center}
+
+
+def write_local_index(ids, vectors, metadata, path=LOCAL_INDEX_PATH, quantization=LOCAL_INDEX_QUANTIZATION):
+    """Persist vectors (.npy) and their ids/metadata (.json) for LocalIndex.
+
+    With quantization set, the compressed codes are written too
+    (<path>.int8.npz or <path>.binary.npz); codes for other modes are removed
+    so they can never go stale.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim != 2 or len(matrix) != len(ids) or len(ids) != len(metadata):
+        raise ValueError("ids, vectors and metadata must have matching lengths")
+
+    # Store unit-length rows so cosine similarity is a plain dot product
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = matrix / norms
+
+    # Write to temp files first so a running chatbot never sees a half-written index
+    np.save(f"{path}.tmp.npy", matrix)
+    with open(f"{path}.tmp.json", "w", encoding="utf-8") as f:
+        json.dump({"ids": list(ids), "metadata": list(metadata)}, f, ensure_ascii=False)
+    if quantization != "none":
+        np.savez(f"{path}.tmp.{quantization}.npz", **_quantize(matrix, quantization))
+    os.replace(f"{path}.tmp.npy", f"{path}.npy")
+    for mode in QUANTIZATION_MODES[1:]:
+        if mode == quantization:
+            os.replace(f"{path}.tmp.{mode}.npz", f"{path}.{mode}.npz")
+        elif os.path.exists(f"{path}.{mode}.npz"):
+            os.remove(f"{path}.{mode}.npz")
+    # The .json goes last: readers reopen the index when it changes (see ChatEngine.index)
+    os.replace(f"{path}.tmp.json", f"{path}.json")
+
+
+class LocalIndex:
+    """In-process cosine index with a Pinecone-compatible query() interface.
+
+    The float vectors stay memory-mapped. With quantization, queries first
+    score the in-memory int8/binary codes, then re-rank a shortlist of
+    top_k * rerank_factor candidates exactly, reading only those float rows.
+    """
+
+    def __init__(self, path=LOCAL_INDEX_PATH, quantization=LOCAL_INDEX_QUANTIZATION,
+                 rerank_factor=LOCAL_INDEX_RERANK_FACTOR):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization {quantization!r}; use one of {', '.join(QUANTIZATION_MODES)}")
+        self.path = path
+        self.quantization = quantization
+        self.rerank_factor = rerank_factor
+        try:
+            self.vectors = np.load(f"{path}.npy", mmap_mode="r")
+            with open(f"{path}.json", "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise Exception(f"Local index not found at {path}.npy / {path}.json. Run ingest.py first.")
+
+        self.ids = data["ids"]
+        self.metadata = data["metadata"]
+        self._columns = {}
+        self.codes = None
+        self.scales = None
+        self.center = None
+        if quantization != "none":
+            self._load_codes()
+
+    def _load_codes(self):
+        try:
+            with np.load(f"{self.path}.{self.quantization}.npz") as data:
+                codes = {name: data[name] for name in data.files}
+        except FileNotFoundError:
+            codes = None
+        if codes is None or len(codes["codes"]) != len(self.ids):
+            # Written before quantization was turned on; build the codes in one pass
+            print(f"No {self.quantization} codes for {self.path}; quantizing {len(self.ids)} vectors")
+            codes = _quantize(np.asarray(self.vectors, dtype=np.float32), self.quantization)
+        self.codes = codes["codes"]
+        self.scales = codes.get("scales")
+        self.center = codes.get("center")
+
+    def bytes_per_vector(self):
+        """Memory per product for the tier that is scanned on every query."""
+        if self.codes is None:
+            return int(self.vectors.shape[1] * self.vectors.itemsize) if self.vectors.ndim == 2 else 0
+        return int(self.codes.shape[1] * self.codes.itemsize)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def describe_index_stats(self):
+        return {
+            "dimension": int(self.vectors.shape[1]) if self.vectors.ndim == 2 else 0,
+            "total_vector_count": len(self.ids),
+            "quantization": self.quantization,
+            "bytes_per_vector": self.bytes_per_vector(),
+        }
+
+    def _column(self, field):
+        """Return (numeric, text) column arrays for a metadata field, built lazily."""
+        if field not in self._columns:
+            values = [m.get(field) for m in self.metadata]
+            numeric = np.array(
+                [float(v) if _is_number(v) else np.nan for v in values], dtype=np.float64
+            )
+            text = np.array([v if isinstance(v, str) else None for v in values], dtype=object)
+            present = np.array([field in m for m in self.metadata], dtype=bool)
+            self._columns[field] = (numeric, text, present)
+        return self._columns[field]
+
+    def _equals(self, field, value):
+        numeric, text, _ = self._column(field)
+        if _is_number(value):
+            return numeric == float(value)
+        return text == value
+
+    def _field_mask(self, field, condition):
+        if not isinstance(condition, dict):
+            # Bare values are an implicit $eq, as in Pinecone
+            condition = {"$eq": condition}
+
+        mask = np.ones(len(self.ids), dtype=bool)
+        for op, value in condition.items():
+            if op == "$eq":
+                mask &= self._equals(field, value)
+            elif op == "$ne":
+                mask &= ~self._equals(field, value)
+            elif op in _RANGE_OPS:
+                if not _is_number(value):
+                    raise ValueError(f"Operator {op} on '{field}' needs a number, got {value!r}")
+                numeric, _, _ = self._column(field)
+                with np.errstate(invalid="ignore"):
+                    mask &= _RANGE_OPS[op](numeric, float(value))
+            elif op in ("$in", "$nin"):
+                hits = np.zeros(len(self.ids), dtype=bool)
+                for item in value:
+                    hits |= self._equals(field, item)
+                mask &= hits if op == "$in" else ~hits
+            elif op == "$exists":
+                _, _, present = self._column(field)
+                mask &= present if value else ~present
+            else:
+                raise ValueError(f"Unsupported filter operator: {op}")
+        return mask
+
+    def filter_mask(self, filter_dict):
+        """Evaluate a Pinecone-style metadata filter into a boolean row mask."""
+        mask = np.ones(len(self.ids), dtype=bool)
+        if not filter_dict:
+            return mask
+        for key, condition in filter_dict.items():
+            if key == "$and":
+                for sub in condition:
+                    mask &= self.filter_mask(sub)
+            elif key == "$or":
+                any_mask = np.zeros(len(self.ids), dtype=bool)
+                for sub in condition:
+                    any_mask |= self.filter_mask(sub)
+                mask &= any_mask
+            else:
+                mask &= self._field_mask(key, condition)
+        return mask
+
+    def query(self, vector, top_k=5, filter=None, include_metadata=False, **kwargs):
+        """Cosine top-k over the stored vectors, shaped like a Pinecone query response."""
+        if len(self.ids) == 0:
+            return {"matches": []}
+
+        query_vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if norm > 0:
+            query_vector = query_vector / norm
+
+        mask = self.filter_mask(filter)
+        candidates = np.flatnonzero(mask)
+        if len(candidates) == 0:
+            return {"matches": []}
+
+        if self.codes is not None:
+            # Coarse search on the codes, then exact scores for the shortlist only
+            candidates = self._shortlist(query_vector, candidates, top_k * self.rerank_factor)
+            candidate_scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ query_vector
+        else:
+            candidate_scores = (self.vectors @ query_vector)[candidates]
+        k = min(top_k, len(candidates))
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+        top = top[np.argsort(-candidate_scores[top])]
+
+        matches = []
+        for pos in top:
+            row = int(candidates[pos])
+            match = {"id": self.ids[row], "score": float(candidate_scores[pos])}
+            if include_metadata:
+                match["metadata"] = self.metadata[row]
+            matches.append(match)
+        return {"matches": matches}
+
+    def _shortlist(self, query_vector, candidates, size):
+        """The `size` candidates scoring best on the compressed codes, in row order."""
+        if len(candidates) <= size:
+            return candidates
+        # Without a filter the codes are scanned in place instead of gathered
+        everything = len(candidates) == len(self.ids)
+        if self.quantization == "binary":
+            codes = self.codes if everything else self.codes[candidates]
+            # Fewer differing sign bits = closer
+            coarse = -_hamming(codes, quantize_binary(query_vector[None, :], self.center)[0])
+        else:
+            # Asymmetric: the float query against dequantized codes
+            weights = query_vector * self.scales
+            coarse = np.empty(len(candidates), dtype=np.float32)
+            for start in range(0, len(candidates), _SCAN_ROWS):
+                if everything:
+                    block = self.codes[start:start + _SCAN_ROWS]
+                else:
+                    block = self.codes[candidates[start:start + _SCAN_ROWS]]
+                coarse[start:start + len(block)] = block.astype(np.float32) @ weights
+        top = np.argpartition(-coarse, size - 1)[:size]
+        # Sorted rows read the memory-mapped float file front to back
+        return np.sort(candidates[top])
+
+
+def recall_report(path=LOCAL_INDEX_PATH, mode="int8", k=5, queries=200, noise=0.5,
+                  rerank_factor=LOCAL_INDEX_RERANK_FACTOR, seed=0):
+    """Recall@k of the quantized search against exact search, with and without re-ranking.
+
+    Queries are stored vectors with Gaussian noise added (noise is the noise
+    norm relative to the unit vector), so each has a realistic neighbourhood.
+    """
+    exact = LocalIndex(path, quantization="none")
+    quantized = LocalIndex(path, quantization=mode)
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(exact), size=min(queries, len(exact)), replace=False)
+    dimension = exact.vectors.shape[1]
+
+    hits = {"coarse": 0, "reranked": 0}
+    seconds = {"exact": 0.0, "reranked": 0.0}
+    for row in rows:
+        vector = np.asarray(exact.vectors[row], dtype=np.float32)
+        vector = vector + rng.standard_normal(dimension).astype(np.float32) * noise / np.sqrt(dimension)
+        started = time.perf_counter()
+        truth = {m["id"] for m in exact.query(vector, k)["matches"]}
+        seconds["exact"] += time.perf_counter() - started
+        # A shortlist of exactly k only reorders the coarse results
+        quantized.rerank_factor = 1
+        hits["coarse"] += len(truth & {m["id"] for m in quantized.query(vector, k)["matches"]})
+        quantized.rerank_factor = rerank_factor
+        started = time.perf_counter()
+        hits["reranked"] += len(truth & {m["id"] for m in quantized.query(vector, k)["matches"]})
+        seconds["reranked"] += time.perf_counter() - started
+
+    total = len(rows) * min(k, len(exact))
+    return {
+        "mode": mode,
+        "k": k,
+        "queries": len(rows),
+        "products": len(exact),
+        "rerank_factor": rerank_factor,
+        "recall_coarse": round(hits["coarse"] / total, 4) if total else None,
+        "recall_reranked": round(hits["reranked"] / total, 4) if total else None,
+        "bytes_per_vector_exact": exact.bytes_per_vector(),
+        "bytes_per_vector_quantized": quantized.bytes_per_vector(),
+        "compression": round(exact.bytes_per_vector() / quantized.bytes_per_vector(), 1),
+        "exact_query_ms": round(seconds["exact"] / len(rows) * 1000, 3) if len(rows) else None,
+        "quantized_query_ms": round(seconds["reranked"] / len(rows) * 1000, 3) if len(rows) else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report recall@k of the quantized local index against exact search")
+    parser.add_argument("--path", default=LOCAL_INDEX_PATH)
+    parser.add_argument("--mode", choices=QUANTIZATION_MODES[1:], nargs="+", default=["int8", "binary"])
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.5, help="Query noise norm relative to the unit vectors")
+    parser.add_argument("--rerank-factor", type=int, default=LOCAL_INDEX_RERANK_FACTOR)
+    args = parser.parse_args()
+    for mode in args.mode:
+        print(json.dumps(recall_report(args.path, mode, args.k, args.queries, args.noise, args.rerank_factor)))
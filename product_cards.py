@@ -0,0 +1,94 @@
+import os
+import re
+from jinja2 import Environment, StrictUndefined
+from lexical_index import code_text
+
+# Answer plain lookups ("price of SKU 103674", "show me Tillamook cheddar") with product
+# cards rendered from metadata instead of a gpt-4o answer
+TEMPLATE_ANSWERS = os.getenv("TEMPLATE_ANSWERS", "true").lower() == "true"
+# Cards shown per answer
+TEMPLATE_MAX_CARDS = int(os.getenv("TEMPLATE_MAX_CARDS", "5"))
+
+_EMPTY = (None, "", "N/A")
+
+# Questions that want description, judgement or comparison go to the LLM
+_DESCRIPTIVE_RE = re.compile(
+    r"\b(taste|tastes|flavou?rs?|texture|aroma|smell|describe|description|tell me (?:more|about)|"
+    r"explain|why|compare|comparison|versus|vs|difference|differ|better|best for|recommend|"
+    r"suggest|pair|pairs|pairing|goes? (?:well )?with|wine|recipe|recipes|cook|melt|melts|"
+    r"substitute|instead of|history|origin|made|healthy|nutrition)\b",
+    re.IGNORECASE,
+)
+# Phrasings that just ask for products or their facts
+_LOOKUP_RE = re.compile(
+    r"\b(price of|prices? for|how much (?:is|are|does|do)|cost of|show me|find|list|look ?up|"
+    r"search for|do you (?:have|carry|sell|stock)|is there|are there|in stock|available|"
+    r"sku|upc|what (?:is|are) the (?:price|sku|upc|weight|unit)|which (?:brands?|products?))\b",
+    re.IGNORECASE,
+)
+_CODE_RE = re.compile(r"\b\d{5,}\b")
+
+CARDS_TEMPLATE = """\
+{% if note %}{{ note | e }}
+
+{% endif %}{% if summary %}{{ summary | e }}
+
+{% endif %}{% for card in cards %}
+#### {{ loop.index }}. {{ card.name | e }}
+{% if card.image %}
+![{{ card.name | e }}]({{ card.image }})
+{% endif %}
+{% if card.brand %}- **Brand:** {{ card.brand | e }}
+{% endif %}{% if card.price is not none %}- **Price:** ${{ "%.2f" | format(card.price) }}{% if card.unit %} / {{ card.unit | e }}{% endif %}
+{% endif %}{% if card.per_pound is not none %}- **Cost per pound:** ${{ "%.2f" | format(card.per_pound) }}
+{% endif %}{% if card.weight is not none %}- **Weight:** {{ card.weight | e }} lb
+{% endif %}{% if card.sku %}- **SKU:** {{ card.sku | e }}{% if card.upc %} · **UPC:** {{ card.upc | e }}{% endif %}
+{% endif %}{% if card.url %}- [View product]({{ card.url }})
+{% endif %}{% endfor %}{% if more %}
+_…and {{ more }} more._
+{% endif %}"""
+
+_environment = Environment(undefined=StrictUndefined, trim_blocks=False, keep_trailing_newline=False)
+_template = _environment.from_string(CARDS_TEMPLATE)
+
+
+def is_lookup(query, exact=False):
+    """True for questions that product facts alone can answer.
+
+    Descriptive or comparative wording always goes to the LLM. exact marks
+    results that are already exact answers (a structured catalog result), which
+    count as lookups unless the question asks for description.
+    """
+    if _DESCRIPTIVE_RE.search(query):
+        return False
+    return exact or bool(_CODE_RE.search(query)) or bool(_LOOKUP_RE.search(query))
+
+
+def _number(value):
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def _card(cheese):
+    value = lambda field: cheese.get(field) if cheese.get(field) not in _EMPTY else None
+    code = lambda field: code_text(value(field)) if value(field) is not None else None
+    sku, upc = code("SKU"), code("UPC")
+    return {
+        "name": value("product_name") or "Unnamed cheese",
+        "brand": value("company_name"),
+        "price": _number(cheese.get("price")),
+        "unit": value("Unit"),
+        "per_pound": _number(cheese.get("Cost per pound")),
+        "weight": _number(cheese.get("weight(pound)")),
+        "sku": sku,
+        # A UPC equal to the SKU adds nothing
+        "upc": upc if upc != sku else None,
+        "image": value("image_url"),
+        "url": value("product_url"),
+    }
+
+
+def render_cards(contexts, summary=None, note=None, max_cards=TEMPLATE_MAX_CARDS):
+    """Markdown product cards for the retrieved products, optionally under a summary or note."""
+    cards = [_card(cheese) for cheese in contexts[:max_cards]]
+    markdown = _template.render(cards=cards, summary=summary, note=note, more=max(0, len(contexts) - max_cards))
+    return re.sub(r"\n{3,}", "\n\n", markdown).strip()
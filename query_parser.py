@@ -0,0 +1,202 @@
+import re
+from catalog_store import read_table
+
+# Unit conversions to pounds for weight filters
+_WEIGHT_UNITS = {
+    "lb": 1.0, "lbs": 1.0, "pound": 1.0, "pounds": 1.0,
+    "oz": 1 / 16, "ounce": 1 / 16, "ounces": 1 / 16,
+    "kg": 2.20462, "kgs": 2.20462, "kilo": 2.20462, "kilos": 2.20462,
+    "kilogram": 2.20462, "kilograms": 2.20462,
+}
+_MONEY_UNITS = {"dollar", "dollars", "buck", "bucks", "usd"}
+
+_LESS = r"under|below|less than|cheaper than|lower than|lighter than|smaller than|at most|up to|no more than|maximum of|max"
+_MORE = r"over|above|more than|greater than|heavier than|bigger than|larger than|at least|no less than|minimum of|min|exceeding"
+_INCLUSIVE = {"at most", "up to", "no more than", "maximum of", "max",
+              "at least", "no less than", "minimum of", "min"}
+
+_AMOUNT = (
+    r"(?P<dollar{n}>\$)?\s*(?P<num{n}>\d+(?:\.\d+)?)\s*"
+    r"(?P<unit{n}>dollars?|bucks?|usd|pounds?|lbs?|oz|ounces?|kgs?|kilos?|kilograms?)?"
+    r"(?P<per{n}>\s*(?:/|per|a)\s*(?:lb|pound)s?\b)?"
+)
+_RANGE_RE = re.compile(
+    r"\b(?:between|from)\s+" + _AMOUNT.format(n=1) + r"\s*(?:and|to|-)\s*" + _AMOUNT.format(n=2),
+    re.IGNORECASE,
+)
+_DASH_RANGE_RE = re.compile(_AMOUNT.format(n=1) + r"\s*-\s*" + _AMOUNT.format(n=2), re.IGNORECASE)
+_COMPARISON_RE = re.compile(
+    r"\b(?P<op>" + _LESS + "|" + _MORE + r")\s+" + _AMOUNT.format(n=1), re.IGNORECASE
+)
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+_PRICE_WORDS = re.compile(r"\b(price|priced|cost|costs|cheap|expensive|spend|budget)\b", re.IGNORECASE)
+_WEIGHT_WORDS = re.compile(r"\b(weigh|weighs|weight|heavy|light|heavier|lighter)\b", re.IGNORECASE)
+_BRAND_CUE = r"\b(?:by|from|brand|made by|maker)\s+(?:the\s+)?"
+_UNKNOWN_BRAND_RE = re.compile(r"\b(?:by|from|brand|made by|maker)\s+[A-Z]")
+_CASE_RE = re.compile(r"\b(?:by the|per|a|in|by)\s+case\b|\bcases\b|\bcase packs?\b", re.IGNORECASE)
+_EACH_RE = re.compile(r"\bsold (?:individually|each)\b|\bper each\b|\bby the each\b|\bsingle units?\b", re.IGNORECASE)
+_SKU_RE = re.compile(r"\b(?:sku|upc|item)\s*#?\s*\d+|\b\d{5,}\b", re.IGNORECASE)
+
+# Superlatives mirror the examples in the LLM filter prompt
+_CHEAPEST_RE = re.compile(r"\b(cheapest|least expensive|lowest price|most affordable)\b", re.IGNORECASE)
+_PRICIEST_RE = re.compile(r"\b(most expensive|priciest|highest price)\b", re.IGNORECASE)
+
+
+class QueryParser:
+    """Rule-based extractor for the metadata filters get_filter_from_llm produces.
+
+    parse() returns (filter_dict or None, confidence). Confidence drops when the
+    query contains numbers or brand cues that could not be attributed to a field,
+    which is the signal to fall back to the LLM. Brand names are often
+    ordinary words ("President", "Packer"), so they only count when written
+    capitalized or after a cue like "by"/"brand"; a lowercase mention without
+    a cue is left to the LLM. With superlatives=False,
+    "cheapest"/"most expensive" are left out of the filter so an exact sort
+    can rank them instead.
+    """
+
+    def __init__(self, companies):
+        # Longest names first so "Galbani Premio" wins over "Galbani"
+        self.companies = sorted(set(companies), key=len, reverse=True)
+        self._company_res = []
+        for name in self.companies:
+            escaped = re.escape(name)
+            self._company_res.append((
+                name,
+                re.compile(r"(?<!\w)" + escaped + r"(?!\w)"),
+                re.compile(_BRAND_CUE + escaped + r"(?!\w)|(?<!\w)" + escaped + r"\s+brand\b", re.IGNORECASE),
+                re.compile(r"(?<!\w)" + escaped + r"(?!\w)", re.IGNORECASE),
+            ))
+
+    @classmethod
+    def from_catalog(cls, path=None):
+        companies = read_table(path).column("company_name").drop_null().to_pylist()
+        return cls(c for c in companies if c)
+
+    @staticmethod
+    def _amount(match, n, context=""):
+        """Resolve one amount group to (field, value), or (None, value) if ambiguous."""
+        value = float(match.group(f"num{n}"))
+        unit = (match.group(f"unit{n}") or "").lower()
+        dollar = bool(match.group(f"dollar{n}")) or unit in _MONEY_UNITS
+        per_pound = bool(match.group(f"per{n}"))
+
+        if per_pound and (dollar or not unit):
+            return "Cost per pound", value
+        if dollar:
+            return "price", value
+        if unit in _WEIGHT_UNITS:
+            return "weight(pound)", round(value * _WEIGHT_UNITS[unit], 4)
+        # A bare number: use nearby wording to decide what it refers to
+        if _WEIGHT_WORDS.search(context):
+            return "weight(pound)", value
+        if _PRICE_WORDS.search(context):
+            return "price", value
+        return None, value
+
+    def parse(self, query, superlatives=True):
+        conditions = []
+        unresolved = 0
+        text = _SKU_RE.sub(" ", query)
+
+        def add(field, op, value):
+            conditions.append({field: {op: value}})
+
+        # Ranges: "between $10 and $20", "from 5 to 10 lbs", "$10-$20"
+        for regex in (_RANGE_RE, _DASH_RANGE_RE):
+            for match in regex.finditer(text):
+                field1, low = self._amount(match, 1, text)
+                field2, high = self._amount(match, 2, text)
+                # A unit on either end applies to both ("5 to 10 lbs")
+                field = field1 or field2
+                if field2 == "weight(pound)" and field1 is None and match.group("unit2"):
+                    low = round(low * _WEIGHT_UNITS[match.group("unit2").lower()], 4)
+                if field is None or (field1 and field2 and field1 != field2):
+                    unresolved += 1
+                else:
+                    add(field, "$gte", min(low, high))
+                    add(field, "$lte", max(low, high))
+            text = regex.sub(" ", text)
+
+        # Comparisons: "under $20", "over 10 pounds", "at most $3/lb"
+        for match in _COMPARISON_RE.finditer(text):
+            op_word = match.group("op").lower()
+            is_less = re.fullmatch(_LESS, op_word) is not None
+            inclusive = op_word in _INCLUSIVE
+            op = ("$lte" if inclusive else "$lt") if is_less else ("$gte" if inclusive else "$gt")
+            field, value = self._amount(match, 1, text)
+            if field is None:
+                unresolved += 1
+            else:
+                add(field, op, value)
+        text = _COMPARISON_RE.sub(" ", text)
+
+        # Any other number left over is something we did not understand
+        unresolved += len(_NUMBER_RE.findall(text))
+
+        if superlatives and _CHEAPEST_RE.search(query):
+            add("price", "$lt", 20)
+        elif superlatives and _PRICIEST_RE.search(query):
+            add("price", "$gt", 190)
+
+        if _CASE_RE.search(query):
+            add("Unit", "$eq", "Case")
+        elif _EACH_RE.search(query):
+            add("Unit", "$eq", "Each")
+
+        brands, unsure, _ = self._match_brands(query)
+        unresolved += unsure
+        if len(brands) == 1:
+            add("company_name", "$eq", brands[0])
+        elif brands:
+            add("company_name", "$in", brands)
+        elif not unsure and _UNKNOWN_BRAND_RE.search(query):
+            # "by SomeBrand" that is not in our vocabulary
+            unresolved += 1
+
+        confidence = 1.0 if unresolved == 0 else 0.3
+        if not conditions:
+            return None, confidence
+        if len(conditions) == 1:
+            return conditions[0], confidence
+        return {"$and": conditions}, confidence
+
+    def _match_brands(self, query):
+        """Brand names from the catalog vocabulary, longest match first.
+
+        Returns (brands, unsure, stripped): unsure counts lowercase mentions
+        with no brand cue, which may just be the ordinary word, and stripped
+        is the query without the accepted brands.
+        """
+        brands = []
+        unsure = 0
+        remaining = stripped = query
+        for name, exact, cued, loose in self._company_res:
+            if exact.search(remaining) or cued.search(remaining):
+                brands.append(name)
+                stripped = loose.sub(" ", stripped)
+            elif loose.search(remaining):
+                unsure += 1
+            else:
+                continue
+            remaining = loose.sub(" ", remaining)
+        return brands, unsure, stripped
+
+    def strip_matched(self, query):
+        """The query without the parts parse() turns into filters (codes, amounts, units, brands)."""
+        text = _SKU_RE.sub(" ", query)
+        for regex in (_RANGE_RE, _DASH_RANGE_RE, _COMPARISON_RE, _CASE_RE, _EACH_RE):
+            text = regex.sub(" ", text)
+        return self._match_brands(text)[2]
+
+
+_default_parser = None
+
+
+def parse_filter(query, catalog_path=None):
+    """Parse a query with a parser built once from the catalog's company names."""
+    global _default_parser
+    if _default_parser is None:
+        _default_parser = QueryParser.from_catalog(catalog_path)
+    return _default_parser.parse(query)
@@ -0,0 +1,67 @@
+import time
+import asyncio
+import threading
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate_per_minute`."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """Block until `amount` tokens are available, then take them."""
+        # A single request larger than the bucket could never be served; clamp it
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+    async def acquire_async(self, amount=1):
+        """Like acquire, but waits without blocking the event loop."""
+        amount = min(float(amount), self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """Combined requests-per-minute and tokens-per-minute limiter for API calls."""
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def acquire(self, tokens=0):
+        self.requests.acquire(1)
+        if tokens:
+            self.tokens.acquire(tokens)
+
+    async def acquire_async(self, tokens=0):
+        await self.requests.acquire_async(1)
+        if tokens:
+            await self.tokens.acquire_async(tokens)
+
+
+def estimate_tokens(text):
+    """Rough token estimate (about 4 characters per token for English text)."""
+    return max(1, len(text) // 4)
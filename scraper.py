@@ -1,180 +1,479 @@
-import time
 import os
+import re
 import json
-import requests
+import argparse
 
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import TimeoutException, NoSuchWindowException, StaleElementReferenceException
-from concurrent.futures import ThreadPoolExecutor
+from selenium.common.exceptions import TimeoutException, NoSuchWindowException, StaleElementReferenceException, WebDriverException
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from contextlib import contextmanager
+from images import fetch_product_images
+from catalog_store import CATALOG_ARROW_PATH, load_catalog, write_catalog
+import telemetry
 import threading
+import queue
 
 cheeses = []
-image_lock = threading.Lock()
+cheeses_lock = threading.Lock()
 
-def download_image(image_url, product_name):
-    if not image_url or not image_url.startswith("http"):
-        return "N/A"
-        
-    try:
-        # Create a safe filename from the product name
-        safe_name = "".join(c for c in product_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-        filename = f"{safe_name}.jpg"
-        output_path = os.path.join("downloaded_images", filename)
-        
-        # Check if image already exists
-        if os.path.exists(output_path):
-            return output_path
-            
-        # Download and save image
-        response = requests.get(image_url, timeout=10)
-        with image_lock:
-            with open(output_path, "wb") as f:
-                f.write(response.content)
-        return output_path
-    except Exception as e:
-        print(f"Failed to download {image_url}: {e}")
-        return "N/A"
+# Number of long-lived Chrome instances used for product detail pages
+SCRAPER_WORKERS = int(os.getenv("SCRAPER_WORKERS", "3"))
+
+LISTING_URL = "https://shop.kimelo.com/department/cheese/3365?page="
+LISTING_PAGES = 5
+PRODUCT_CARD_SELECTOR = '.chakra-card.group.css-5pmr4x'
+
+# JSON Lines checkpoint written while streaming products to ingest
+STREAM_PATH = "cheese_data.jsonl"
 
-def scrape_links(url, index):
+# Listing-card fingerprints (name, price, image src per product URL) from the last complete crawl
+FINGERPRINTS_PATH = os.getenv("SCRAPER_FINGERPRINTS_PATH", "cheese_fingerprints.json")
+
+_PRICE_RE = re.compile(r"\$\s*\d[\d,]*(?:\.\d+)?")
+
+# Everything the listing cards show, read in one round trip per page
+_READ_CARDS_JS = """
+return arguments[0].map(card => {
+    const image = card.querySelector('img');
+    const heading = card.querySelector('h1, h2, h3, h4, h5, h6, .chakra-heading');
+    return {
+        url: card.href,
+        name: heading ? heading.innerText : '',
+        text: card.innerText,
+        image: image ? (image.currentSrc || image.src) : '',
+    };
+});
+"""
+
+def chrome_options():
     chrome_options = Options()
     chrome_options.add_argument('--headless')
     chrome_options.add_argument("--start-maximized")
     chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--no-sandbox")
     chrome_options.add_argument("--disable-dev-shm-usage")
-    
+    return chrome_options
+
+class DriverPool:
+    """Bounded pool of reusable headless Chrome drivers.
+
+    Drivers are started lazily and one at a time, so the pool never launches
+    several browsers at once. A driver that breaks is quit and replaced on
+    the next checkout.
+    """
+
+    def __init__(self, size=SCRAPER_WORKERS):
+        self.size = size
+        self.idle = queue.Queue()
+        self.created = 0
+        self.all_drivers = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                driver = webdriver.Chrome(options=chrome_options())
+                self.created += 1
+                self.all_drivers.append(driver)
+                return driver
+        return self.idle.get()
+
+    def release(self, driver, broken=False):
+        if not broken:
+            self.idle.put(driver)
+            return
+        with self.lock:
+            self.created -= 1
+            if driver in self.all_drivers:
+                self.all_drivers.remove(driver)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    @contextmanager
+    def driver(self):
+        driver = self.acquire()
+        broken = False
+        try:
+            yield driver
+        except (NoSuchWindowException, WebDriverException) as e:
+            # Timeouts are page problems; anything else may have killed the browser
+            broken = not isinstance(e, TimeoutException)
+            raise
+        finally:
+            self.release(driver, broken)
+
+    def close(self):
+        with self.lock:
+            drivers, self.all_drivers = self.all_drivers, []
+            self.created = 0
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+class CardsReady:
+    """Wait condition: product cards are present and their count has stopped changing."""
+
+    def __init__(self, selector=PRODUCT_CARD_SELECTOR):
+        self.selector = selector
+        self.last_count = -1
+
+    def __call__(self, driver):
+        cards = [card for card in driver.find_elements(By.CSS_SELECTOR, self.selector)
+                 if card.get_attribute('href')]
+        if cards and len(cards) == self.last_count:
+            return cards
+        self.last_count = len(cards)
+        return False
+
+def read_listing_cards(driver, cards):
+    """URL, name, listing price and image src of each product card on a listing page."""
+    listings = []
+    for card in driver.execute_script(_READ_CARDS_JS, cards):
+        lines = [line.strip() for line in (card["text"] or "").splitlines() if line.strip()]
+        prices = [match.group().replace(" ", "") for line in lines for match in _PRICE_RE.finditer(line)]
+        image = card["image"] or ""
+        listings.append({
+            "url": card["url"],
+            # Without a heading, the product name is taken to be the longest line without a price
+            "name": (card["name"] or "").strip()
+                    or max((line for line in lines if not _PRICE_RE.search(line)), key=len, default=""),
+            "price": prices[0] if prices else "",
+            # Lazy-loaded images show a data: placeholder until they scroll into view
+            "image": "" if image.startswith("data:") else image,
+        })
+    return listings
+
+class ChangeDetector:
+    """Classifies listed products as added, changed or unchanged against the last complete crawl.
+
+    Incremental crawls skip unchanged products and carry their previous record forward.
+    """
+
+    def __init__(self, incremental=False, path=FINGERPRINTS_PATH):
+        self.incremental = incremental
+        self.path = path
+        self.previous = self._load_fingerprints()
+        self.records = self._load_records()
+        self.listed = {}
+        self.stale = set()
+        self.counts = {"added": 0, "changed": 0, "unchanged": 0, "removed": 0, "skipped": 0, "failed": 0}
+
+    def _load_fingerprints(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @staticmethod
+    def _load_records():
+        try:
+            # Plain dicts, so the memory-mapped catalog is released before it is rewritten
+            return {cheese["product_url"]: cheese for cheese in load_catalog() if cheese.get("product_url")}
+        except (OSError, ValueError) as e:
+            print(f"No previous catalog to compare against: {str(e)}")
+            return {}
+
+    def see(self, listing):
+        """Record a listing card; False if the product was already listed on an earlier page."""
+        if listing["url"] in self.listed:
+            return False
+        self.listed[listing["url"]] = {key: listing[key] for key in ("name", "price", "image")}
+        return True
+
+    def status(self, url):
+        if url not in self.records:
+            return "added"
+        return "unchanged" if self.previous.get(url) == self.listed[url] else "changed"
+
+    def carry_forward(self, url):
+        """The previous record of an unchanged product, or None if its detail page must be scraped."""
+        status = self.status(url)
+        self.counts[status] += 1
+        if status != "unchanged" or not self.incremental:
+            return None
+        self.counts["skipped"] += 1
+        return self.records[url]
+
+    def scrape_failed(self, url):
+        """The previous record, if any; the fingerprint is not saved, so the next run retries it."""
+        self.counts["failed"] += 1
+        self.stale.add(url)
+        return self.records.get(url)
+
+    def removed(self):
+        """Previous products no longer listed; the new catalog leaves them out, so ingest deletes them."""
+        return [cheese for url, cheese in self.records.items() if url not in self.listed]
+
+    def save(self, cheeses):
+        """Save the fingerprints of the products in the new catalog."""
+        urls = {cheese.get("product_url") for cheese in cheeses}
+        fingerprints = {url: fingerprint for url, fingerprint in self.listed.items()
+                        if url in urls and url not in self.stale}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(fingerprints, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def report(self):
+        self.counts["removed"] = len(self.removed())
+        for change, amount in self.counts.items():
+            telemetry.count("crawl_products_total", amount, change=change)
+        for cheese in self.removed():
+            print(f"Removed: {cheese.get('product_name', cheese['product_url'])}")
+        print("Crawl changes: " + ", ".join(f"{amount} {change}" for change, amount in self.counts.items()))
+        return dict(self.counts)
+
+def scrape_product_page(driver, url):
+    """Scrape one product detail page with an already-open driver."""
     # Initialize variables
     size = "N/A"
     weight = "N/A"
     image_url = "N/A"
     number1 = "N/A"
+    wait = WebDriverWait(driver, 3)
+    
+    print(f"Navigating to: {url}")
+    driver.get(url)
+    
+    # Wait for main elements to load
+    wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ".chakra-heading.css-18j379d")))
+    
+    # Get all required data in one go
+    product_name = driver.find_element(By.CSS_SELECTOR, ".chakra-heading.css-18j379d").text
+    company_name = driver.find_element(By.CSS_SELECTOR, ".chakra-text.css-drbcjm").text
+    
+    # Get numbers
+    nums = driver.find_elements(By.CSS_SELECTOR, ".chakra-text.css-0")
+    num1 = nums[0].text if len(nums) > 0 else "N/A"
+    num2 = nums[1].text if len(nums) > 1 else "N/A"
+    
+    # Get price and unit price
+    unit_price = driver.find_element(By.CSS_SELECTOR, ".chakra-badge.css-1mwp5d1").text
+    
+    # Get other info
+    otherinfo = driver.find_elements(By.CSS_SELECTOR, ".css-1eyncsv")
+    if len(otherinfo) == 3:
+        size = otherinfo[1].text
+        weight = otherinfo[2].text
+    else:
+        size = otherinfo[3].text if len(otherinfo) > 3 else "N/A"
+        weight = otherinfo[5].text if len(otherinfo) > 5 else "N/A"
+    
+    # Get image URL
+    image_elements = driver.find_elements(By.CSS_SELECTOR, '.object-contain.transition-opacity.opacity-0.opacity-100')
+    if image_elements:
+        image_url = image_elements[0].get_attribute("src")
+    
+    numbers = driver.find_elements(By.CSS_SELECTOR, ".chakra-text.css-0")
+    for index , number in enumerate(numbers):
+        if index == 6:
+            number1 = number
+            print(f"number1: {number1.text}")
+    # Create cheese entry
+    cheese_entry = {
+        "product_name": product_name,
+        "company_name": company_name,
+        "price": float(num2.replace("$","")),
+        "Unit": num1,
+        "Cost per pound": float(unit_price.split('/')[0].replace("$","")),
+        "standard": size,
+        "weight(pound)": float(weight.split(' ')[0]),
+        "SKU": int(number1.text),
+        "UPC": int(number1.text),
+        "image_url": image_url,
+        "product_url": url
+    }
+    print(f"cheese_entry: {cheese_entry}")
+    return cheese_entry
+
+class ProductStream:
+    """Append-only JSON Lines checkpoint of scraped products, optionally feeding an ingestor.
+
+    A crawl that dies part-way leaves the file behind; the next streaming run
+    loads it and skips the product pages already scraped.
+    """
+
+    def __init__(self, path=STREAM_PATH, ingestor=None):
+        self.path = path
+        self.ingestor = ingestor
+        self.lock = threading.Lock()
+
+    def load_checkpoint(self):
+        products = []
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        products.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # A crash mid-write can leave a truncated last line
+                        continue
+        except FileNotFoundError:
+            pass
+        return products
+
+    def emit(self, cheese_entry):
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(cheese_entry, ensure_ascii=False) + "\n")
+        if self.ingestor is not None:
+            self.ingestor.submit(cheese_entry)
+
+    def finish(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def scrape_links(url, pool, stream=None):
+    """Scrape a product page using a driver checked out from the pool; returns the entry, or None on failure."""
     try:
-        driver = webdriver.Chrome(options=chrome_options)
-        wait = WebDriverWait(driver, 3)
-        
-        print(f"Navigating to: {url}")
-        driver.get(url)
-        
-        # Wait for main elements to load
-        wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ".chakra-heading.css-18j379d")))
-        
-        # Get all required data in one go
-        product_name = driver.find_element(By.CSS_SELECTOR, ".chakra-heading.css-18j379d").text
-        company_name = driver.find_element(By.CSS_SELECTOR, ".chakra-text.css-drbcjm").text
-        
-        # Get numbers
-        nums = driver.find_elements(By.CSS_SELECTOR, ".chakra-text.css-0")
-        num1 = nums[0].text if len(nums) > 0 else "N/A"
-        num2 = nums[1].text if len(nums) > 1 else "N/A"
-        
-        # Get price and unit price
-        unit_price = driver.find_element(By.CSS_SELECTOR, ".chakra-badge.css-1mwp5d1").text
-        
-        # Get other info
-        otherinfo = driver.find_elements(By.CSS_SELECTOR, ".css-1eyncsv")
-        if len(otherinfo) == 3:
-            size = otherinfo[1].text
-            weight = otherinfo[2].text
-        else:
-            size = otherinfo[3].text if len(otherinfo) > 3 else "N/A"
-            weight = otherinfo[5].text if len(otherinfo) > 5 else "N/A"
-        
-        # Get image URL
-        image_elements = driver.find_elements(By.CSS_SELECTOR, '.object-contain.transition-opacity.opacity-0.opacity-100')
-        if image_elements:
-            image_url = image_elements[0].get_attribute("src")
-        
-        numbers = driver.find_elements(By.CSS_SELECTOR, ".chakra-text.css-0")
-        for index , number in enumerate(numbers):
-            if index == 6:
-                number1 = number
-                print(f"number1: {number1.text}")
-        # Create cheese entry
-        cheese_entry = {
-            "product_name": product_name,
-            "company_name": company_name,
-            "price": float(num2.replace("$","")),
-            "Unit": num1,
-            "Cost per pound": float(unit_price.split('/')[0].replace("$","")),
-            "standard": size,
-            "weight(pound)": float(weight.split(' ')[0]),
-            "SKU": int(number1.text),
-            "UPC": int(number1.text),
-            "image_url": image_url
-        }
-        print(f"cheese_entry: {cheese_entry}")
-        # Download image in a separate thread
-        # if image_url != "N/A":
-        #     with ThreadPoolExecutor(max_workers=1) as executor:
-        #         future = executor.submit(download_image, image_url, product_name)
-        #         cheese_entry["image_path"] = future.result()
-        
-        cheeses.append(cheese_entry)
-        print(f"Processed: {product_name}")
-        
+        with pool.driver() as driver, telemetry.span("scrape_product_page"):
+            cheese_entry = scrape_product_page(driver, url)
+
+        with cheeses_lock:
+            cheeses.append(cheese_entry)
+        if stream is not None:
+            stream.emit(cheese_entry)
+        telemetry.count("products_scraped_total")
+        print(f"Processed: {cheese_entry['product_name']}")
+        return cheese_entry
+
     except Exception as e:
+        telemetry.error("scrape_product_page", e)
         print(f"An error occurred: {str(e)}")
-    finally:
-        try:
-            driver.quit()
-        except:
-            pass
+        return None
+
+def scrape_cheese(stream_ingest=False, incremental=False):
+    """Crawl the cheese department and save the catalog (Arrow, plus its JSON copy).
 
-def scrape_cheese():
+    With stream_ingest=True, products are checkpointed to cheese_data.jsonl
+    and embedded/upserted in micro-batches while the crawl continues.
+    With incremental=True, only new products and products whose listing
+    card changed since the last complete crawl get their detail page
+    scraped; the rest keep their previous record. Every complete crawl
+    saves the listing fingerprints the next incremental one compares with.
+    Returns the added/changed/unchanged/removed/skipped/failed counts.
+    """
     # Create images directory once
     os.makedirs("downloaded_images", exist_ok=True)
-    
-    # Set up Chrome options
-    chrome_options = Options()
-    chrome_options.add_argument('--headless') 
-    chrome_options.add_argument("--start-maximized")
-    chrome_options.add_argument("--disable-gpu")
-    chrome_options.add_argument("--no-sandbox")
-    chrome_options.add_argument("--disable-dev-shm-usage")
-    
+
+    pool = DriverPool(SCRAPER_WORKERS)
+    changes = ChangeDetector(incremental)
+    futures = {}
+    stream = None
+    done_urls = set()
+    complete = False
+    if stream_ingest:
+        # Imported lazily: ingest sets up API clients at import time
+        from ingest import StreamIngestor
+        stream = ProductStream(ingestor=StreamIngestor())
+        resumed = stream.load_checkpoint()
+        if resumed:
+            print(f"Resuming crawl: {len(resumed)} products already scraped")
+        for cheese_entry in resumed:
+            cheeses.append(cheese_entry)
+            done_urls.add(cheese_entry.get("product_url"))
+            stream.ingestor.submit(cheese_entry)
+
     try:
-        driver = webdriver.Chrome(options=chrome_options)
-        wait = WebDriverWait(driver, 5)
-        
-        urls = ["https://shop.kimelo.com/department/cheese/3365?page=" + str(i) for i in range(1, 6)]
-        for url in urls:
-            print(f"Navigating to: {url}")
-            driver.get(url)
-            
-            # Wait for the page to load and products to be visible
-            wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, ".relative.css-1bpq4gx")))
-            
-            # Give extra time for dynamic content
-            time.sleep(2)
-            
-            # Find all product cards on the page
-            links = driver.find_elements(By.CSS_SELECTOR, '.chakra-card.group.css-5pmr4x')
-            
-            # Process links in parallel
-            with ThreadPoolExecutor(max_workers=3) as executor:
-                executor.map(lambda x: scrape_links(x.get_attribute('href'), 0), links)
-            
-        print("\nSaving data to cheese_data.json...")
-        with open("cheese_data.json", "w", encoding="utf-8") as f:
-            json.dump(cheeses, f, ensure_ascii=False, indent=2)
+        # The listing driver stays separate from the pool so it can load the
+        # next page while pooled drivers work through product details
+        driver = webdriver.Chrome(options=chrome_options())
+        wait = WebDriverWait(driver, 10)
+
+        with ThreadPoolExecutor(max_workers=SCRAPER_WORKERS) as executor:
+            urls = [LISTING_URL + str(i) for i in range(1, LISTING_PAGES + 1)]
+            for url in urls:
+                print(f"Navigating to: {url}")
+                with telemetry.span("scrape_listing_page"):
+                    driver.get(url)
+
+                    # Wait until the product cards have rendered and stopped changing
+                    cards = wait.until(CardsReady())
+
+                    # Read the cards now; the elements go stale once the next page loads
+                    listings = read_listing_cards(driver, cards)
+
+                # Queue detail pages and move straight on to the next listing page
+                for listing in listings:
+                    link = listing["url"]
+                    if not changes.see(listing) or link in done_urls:
+                        continue
+                    carried = changes.carry_forward(link)
+                    if carried is not None:
+                        with cheeses_lock:
+                            cheeses.append(carried)
+                        if stream is not None:
+                            stream.ingestor.submit(carried)
+                        continue
+                    futures[executor.submit(scrape_links, link, pool, stream)] = link
+
+            wait_futures(futures)
+        for future, link in futures.items():
+            if future.result() is None:
+                stale = changes.scrape_failed(link)
+                if stale is not None:
+                    cheeses.append(stale)
+        complete = True
+
+        # Fetch all product images concurrently and attach local thumbnails
+        with telemetry.span("fetch_images"):
+            fetch_product_images(cheeses)
+
+        print(f"\nSaving data to {CATALOG_ARROW_PATH}...")
+        write_catalog(cheeses)
+        changes.save(cheeses)
             
         print(f"Successfully scraped {len(cheeses)} cheese products")
+        return changes.report()
         
-    except TimeoutException:
+    except TimeoutException as e:
+        telemetry.error("scrape_listing_page", e)
         print("Timeout waiting for elements to load")
-    except NoSuchWindowException:
+    except NoSuchWindowException as e:
+        telemetry.error("scrape_listing_page", e)
         print("Browser window was closed unexpectedly")
     except Exception as e:
+        telemetry.error("scrape", e)
         print(f"An error occurred: {str(e)}")
     finally:
         try:
             driver.quit()
         except:
             pass
+        pool.close()
+
+        if stream is not None:
+            if complete:
+                # Re-submit so image_path from the image pass reaches the index
+                for cheese_entry in cheeses:
+                    stream.ingestor.submit(cheese_entry)
+                stream.ingestor.close(seen_skus=[c["SKU"] for c in cheeses])
+                stream.finish()
+            else:
+                # Keep the checkpoint so the next run resumes; don't delete anything
+                stream.ingestor.close()
+        telemetry.write_textfile()
 
 if __name__ == "__main__":
-    scrape_cheese()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Scrape cheese products from shop.kimelo.com")
+    parser.add_argument("--stream-ingest", action="store_true",
+                        help="Index products while crawling and checkpoint to cheese_data.jsonl")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only scrape detail pages of new products and products whose listing card changed")
+    args = parser.parse_args()
+    scrape_cheese(stream_ingest=args.stream_ingest, incremental=args.incremental)
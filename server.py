@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import tornado.web
+import tornado.httpserver
+import tornado.iostream
+from dotenv import load_dotenv
+from engine import ChatEngine, TURN_DEADLINE
+import telemetry
+
+load_dotenv()
+
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+# Chat turns running at once; more requests wait in a bounded queue
+SERVER_MAX_CONCURRENCY = int(os.getenv("SERVER_MAX_CONCURRENCY", "16"))
+# Requests allowed to wait for a slot; beyond that they get 503 straight away
+SERVER_MAX_QUEUE = int(os.getenv("SERVER_MAX_QUEUE", "64"))
+# Seconds a request may wait for a slot before it gets 503
+SERVER_QUEUE_TIMEOUT = float(os.getenv("SERVER_QUEUE_TIMEOUT", "5"))
+# Largest accepted request body, in bytes
+SERVER_MAX_BODY = int(os.getenv("SERVER_MAX_BODY", str(64 * 1024)))
+
+
+class Overloaded(Exception):
+    pass
+
+
+class AdmissionLimiter:
+    """Caps concurrent turns and the queue in front of them (backpressure).
+
+    Requests beyond the queue, or that wait longer than the queue timeout,
+    are rejected so callers can back off instead of piling up latency.
+    """
+
+    def __init__(self, concurrency=SERVER_MAX_CONCURRENCY, max_queue=SERVER_MAX_QUEUE,
+                 queue_timeout=SERVER_QUEUE_TIMEOUT):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self.active = 0
+
+    async def acquire(self):
+        if self.semaphore.locked() and self.waiting >= self.max_queue:
+            telemetry.count("server_rejected_total", reason="queue_full")
+            raise Overloaded("queue full")
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            telemetry.count("server_rejected_total", reason="queue_timeout")
+            raise Overloaded("queue timeout")
+        finally:
+            self.waiting -= 1
+        telemetry.observe("server_queue_seconds", time.perf_counter() - started)
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.semaphore.release()
+
+
+class BaseHandler(tornado.web.RequestHandler):
+    def initialize(self, engine, limiter):
+        self.engine = engine
+        self.limiter = limiter
+
+    def write_error(self, status_code, **kwargs):
+        self.finish({"error": self._reason})
+
+    def json_body(self, required=()):
+        try:
+            body = json.loads(self.request.body or b"{}")
+        except json.JSONDecodeError:
+            raise tornado.web.HTTPError(400, reason="Body must be JSON")
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, reason="Body must be a JSON object")
+        for field in required:
+            if not isinstance(body.get(field), str) or not body[field].strip():
+                raise tornado.web.HTTPError(400, reason=f"'{field}' must be a non-empty string")
+        top_k = body.get("top_k", 5)
+        if not isinstance(top_k, int) or not 1 <= top_k <= 20:
+            raise tornado.web.HTTPError(400, reason="'top_k' must be an integer between 1 and 20")
+        if body.get("mode", "auto") not in ("auto", "generate"):
+            raise tornado.web.HTTPError(400, reason="'mode' must be 'auto' or 'generate'")
+        return body
+
+    async def admit(self):
+        try:
+            await self.limiter.acquire()
+        except Overloaded as e:
+            self.set_header("Retry-After", "1")
+            raise tornado.web.HTTPError(503, reason=f"Server overloaded ({e})")
+
+
+class ChatHandler(BaseHandler):
+    """POST /v1/chat {"question", "previous_answer"?, "top_k"?, "mode"?} -> {"answer", "contexts", "mode"}
+
+    mode "auto" answers product lookups with cards; "generate" always asks gpt-4o.
+    """
+
+    async def post(self):
+        body = self.json_body(required=("question",))
+        await self.admit()
+        stats = {}
+        try:
+            with telemetry.trace("api_chat") as turn_trace:
+                contexts, answer = await self.engine.answer_turn(
+                    body["question"], body.get("previous_answer") or "", body.get("top_k", 5),
+                    mode=body.get("mode", "auto"), stats=stats,
+                )
+        except TimeoutError as e:
+            telemetry.error("api_chat", e)
+            raise tornado.web.HTTPError(504, reason="Timed out answering the question")
+        finally:
+            self.limiter.release()
+        self.finish({"answer": answer, "contexts": contexts, "mode": stats.get("mode"),
+                     "trace": turn_trace.summary()})
+
+
+class ChatStreamHandler(BaseHandler):
+    """POST /v1/chat/stream: the same turn as Server-Sent Events (contexts, delta..., done)."""
+
+    async def post(self):
+        body = self.json_body(required=("question",))
+        await self.admit()
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+        events = self.engine.stream_turn(body["question"], body.get("previous_answer") or "",
+                                         body.get("top_k", 5), mode=body.get("mode", "auto"))
+        try:
+            with telemetry.trace("api_chat_stream"):
+                async for event in events:
+                    self.write(f"event: {event['event']}\ndata: {json.dumps(event, default=str)}\n\n")
+                    await self.flush()
+        except tornado.iostream.StreamClosedError:
+            # The client went away; stop generating
+            telemetry.count("server_disconnects_total")
+        except Exception as e:
+            telemetry.error("api_chat_stream", e)
+            message = "Timed out answering the question" if isinstance(e, TimeoutError) else str(e)
+            self.write(f"event: error\ndata: {json.dumps({'error': message})}\n\n")
+        finally:
+            await events.aclose()
+            self.limiter.release()
+        self.finish()
+
+
+class SearchHandler(BaseHandler):
+    """POST /v1/search {"query", "top_k"?} -> {"results"}: retrieval only, no generation."""
+
+    async def post(self):
+        body = self.json_body(required=("query",))
+        await self.admit()
+        try:
+            results = await asyncio.wait_for(self.engine.search(body["query"], body.get("top_k", 5)), TURN_DEADLINE)
+        except TimeoutError as e:
+            telemetry.error("api_search", e)
+            raise tornado.web.HTTPError(504, reason="Timed out searching")
+        finally:
+            self.limiter.release()
+        self.finish({"results": results})
+
+
+class HealthHandler(BaseHandler):
+    def get(self):
+        self.finish({"ok": True, "active": self.limiter.active, "waiting": self.limiter.waiting})
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.finish(telemetry.metrics.prometheus_text())
+
+
+def make_app(engine=None, limiter=None):
+    """Build the Tornado application; call from the loop it will run on."""
+    engine = engine or ChatEngine()
+    limiter = limiter or AdmissionLimiter()
+    args = {"engine": engine, "limiter": limiter}
+    return tornado.web.Application([
+        (r"/v1/chat", ChatHandler, args),
+        (r"/v1/chat/stream", ChatStreamHandler, args),
+        (r"/v1/search", SearchHandler, args),
+        (r"/healthz", HealthHandler, args),
+        (r"/metrics", MetricsHandler),
+    ])
+
+
+async def serve(port=SERVER_PORT, host="0.0.0.0"):
+    app = make_app()
+    server = tornado.httpserver.HTTPServer(app, max_body_size=SERVER_MAX_BODY)
+    server.listen(port, host)
+    print(f"Cheese chat API listening on http://{host}:{port}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the cheese chatbot as an HTTP API")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--host", default="0.0.0.0")
+    args = parser.parse_args()
+    asyncio.run(serve(args.port, args.host))
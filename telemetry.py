@@ -0,0 +1,228 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Spans and counters; when off, span() is a shared no-op and count() returns at once
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "true").lower() == "true"
+# One JSON object per span/error on stderr
+TELEMETRY_JSON_LOGS = os.getenv("TELEMETRY_JSON_LOGS", "false").lower() == "true"
+# Serve Prometheus text on http://<host>:<port>/metrics (0 = off)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Prometheus textfile written by batch jobs (ingest.py, scraper.py); empty = off
+METRICS_TEXTFILE = os.getenv("METRICS_TEXTFILE", "")
+
+# Histogram buckets for span durations, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger("cheese")
+_current_trace = contextvars.ContextVar("cheese_trace", default=None)
+_NOOP = nullcontext()
+
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {"ts": round(record.created, 3), "level": record.levelname.lower(), "msg": record.getMessage()}
+        payload.update(getattr(record, "fields", {}))
+        return json.dumps(payload, default=str)
+
+
+if TELEMETRY_JSON_LOGS and not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(_JsonFormatter())
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value)}"' for name, value in key) + "}"
+
+
+class Metrics:
+    """Thread-safe counters and duration histograms with Prometheus text output."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, amount=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def snapshot(self):
+        """Counters and per-histogram count/mean, for display."""
+        with self.lock:
+            counters = {f"{name}{_format_labels(key)}": value for (name, key), value in self.counters.items()}
+            histograms = {
+                f"{name}{_format_labels(key)}": {"count": h["count"], "mean_ms": h["sum"] / h["count"] * 1000}
+                for (name, key), h in self.histograms.items() if h["count"]
+            }
+        return {"counters": counters, "histograms": histograms}
+
+    def prometheus_text(self):
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE cheese_{name} counter")
+                for (metric, key), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f"cheese_{name}{_format_labels(key)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE cheese_{name} histogram")
+                for (metric, key), h in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, value in zip(BUCKETS, h["buckets"]):
+                        lines.append(f"cheese_{name}_bucket{_format_labels(key + (('le', bound),))} {value}")
+                    lines.append(f"cheese_{name}_bucket{_format_labels(key + (('le', '+Inf'),))} {h['count']}")
+                    lines.append(f"cheese_{name}_sum{_format_labels(key)} {h['sum']:.6f}")
+                    lines.append(f"cheese_{name}_count{_format_labels(key)} {h['count']}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class Trace:
+    """The spans recorded for one unit of work (a chat turn, an ingest run)."""
+
+    def __init__(self, name):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def summary(self):
+        return [{"stage": name, "ms": round(seconds * 1000, 1), **attrs} for name, seconds, attrs in self.spans]
+
+
+@contextmanager
+def trace(name):
+    """Collect the spans of everything run inside this block (including tasks it starts)."""
+    current = Trace(name)
+    token = _current_trace.set(current)
+    try:
+        with span(name):
+            yield current
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def _span(name, attrs):
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException as e:
+        status = "cancelled" if type(e).__name__ == "CancelledError" else "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        metrics.observe("stage_seconds", seconds, stage=name, status=status)
+        current = _current_trace.get()
+        if current is not None:
+            current.spans.append((name, seconds, dict(attrs, status=status) if status != "ok" else attrs))
+        if TELEMETRY_JSON_LOGS:
+            logger.info("span", extra={"fields": {
+                "span": name, "ms": round(seconds * 1000, 2), "status": status,
+                "trace_id": current.trace_id if current else None, **attrs,
+            }})
+
+
+def span(name, **attrs):
+    """Time a block as a pipeline stage: a duration histogram, trace entry and JSON log."""
+    if not TELEMETRY_ENABLED:
+        return _NOOP
+    return _span(name, attrs)
+
+
+def count(name, amount=1, **labels):
+    if TELEMETRY_ENABLED:
+        metrics.count(name, amount, **labels)
+
+
+def observe(name, seconds, **labels):
+    if TELEMETRY_ENABLED:
+        metrics.observe(name, seconds, **labels)
+
+
+def error(stage, exc):
+    """Count a failure and log it with its stage; callers still print or show it as before."""
+    count("failures_total", stage=stage, error=type(exc).__name__)
+    if TELEMETRY_JSON_LOGS:
+        current = _current_trace.get()
+        logger.error(str(exc), extra={"fields": {
+            "stage": stage, "error": type(exc).__name__, "trace_id": current.trace_id if current else None,
+        }})
+
+
+def record_usage(usage, model="gpt-4o"):
+    """Count prompt/completion tokens from an OpenAI usage object."""
+    if usage is None:
+        return
+    count("tokens_total", getattr(usage, "prompt_tokens", 0) or 0, model=model, kind="prompt")
+    count("tokens_total", getattr(usage, "completion_tokens", 0) or 0, model=model, kind="completion")
+
+
+def write_textfile(path=METRICS_TEXTFILE):
+    """Write the metrics in Prometheus text format (node_exporter textfile collector style)."""
+    if not path or not TELEMETRY_ENABLED:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(metrics.prometheus_text())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = metrics.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_metrics_server(port=METRICS_PORT, host="0.0.0.0"):
+    """Serve /metrics in a daemon thread; returns the server, or None when disabled."""
+    if not port or not TELEMETRY_ENABLED:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    return server
@@ -0,0 +1,37 @@
+import numpy as np
+from answer_cache import AnswerCache
+
+
+def make_cache(tmp_path, **kwargs):
+    return AnswerCache(path=str(tmp_path / "answers.sqlite3"), version_path=str(tmp_path / "version.json"), **kwargs)
+
+
+def vector(seed, noise=0.0):
+    rng = np.random.default_rng(seed)
+    base = np.random.default_rng(0).normal(size=64)
+    return base + noise * rng.normal(size=64)
+
+
+def test_semantic_hit_needs_the_same_filter(tmp_path):
+    cache = make_cache(tmp_path)
+    under_20 = {"price": {"$lt": 20.0}}
+    cache.put("cheeses under $20", vector(1), "cheap answer", [], under_20)
+
+    # A near-identical embedding with a different price filter is not a hit
+    assert cache.get("cheeses under $30", vector(2, noise=0.01), {"price": {"$lt": 30.0}}) is None
+    assert cache.get("cheese under $20 please", vector(2, noise=0.01), under_20)["answer"] == "cheap answer"
+
+
+def test_put_keeps_the_matrix_in_step_and_evicts_lru(tmp_path):
+    cache = make_cache(tmp_path, max_entries=3)
+    for i in range(5):
+        cache.put(f"question {i}", np.eye(64)[i], f"answer {i}", [])
+    cache.put("question 4", np.eye(64)[4], "answer 4 again", [])
+
+    assert cache._keys == ["question 2", "question 3", "question 4"]
+    assert cache._matrix.shape == (3, 64)
+    assert cache.get("anything", np.eye(64)[4])["answer"] == "answer 4 again"
+    assert cache.get("question 0") is None
+
+    # A fresh instance loads the same entries from SQLite
+    assert sorted(make_cache(tmp_path)._keys) == cache._keys
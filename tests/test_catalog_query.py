@@ -0,0 +1,75 @@
+import os
+import json
+import pytest
+from conftest import ROOT
+from catalog_query import CatalogQuery
+from query_parser import QueryParser
+
+CATALOG = os.path.join(ROOT, "cheese_data.json")
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    with open(CATALOG, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope="module")
+def query():
+    return CatalogQuery.from_catalog(CATALOG)
+
+
+def brand_count(catalog, brand):
+    return sum(1 for cheese in catalog if cheese.get("company_name") == brand)
+
+
+def test_count_by_brand_matches_catalog(catalog, query):
+    result = query.answer("how many Tillamook products")
+    assert result["intent"] == "count"
+    assert result["summary"].startswith(f"Exactly {brand_count(catalog, 'Tillamook')} products")
+
+
+@pytest.mark.parametrize("question, brand", [
+    ("cheapest Galbani cheese", "Galbani"),
+    ("most expensive President cheese", "President"),
+])
+def test_superlative_ranks_over_every_brand_product(catalog, query, question, brand):
+    result = query.answer(question)
+    assert result["intent"] == "top_n"
+    assert f"ranked exactly over {brand_count(catalog, brand)} matching products" in result["summary"]
+    assert all(row["company_name"] == brand for row in result["rows"])
+
+
+def test_superlative_picks_the_extreme(catalog, query):
+    result = query.answer("cheapest Galbani cheese")
+    cheapest = min(c["price"] for c in catalog if c.get("company_name") == "Galbani")
+    assert result["rows"][0]["price"] == cheapest
+
+
+@pytest.mark.parametrize("question", [
+    "What is the typical flavor of brie?",
+    "How many calories are in feta?",
+])
+def test_non_aggregate_questions_fall_through(query, question):
+    assert query.answer(question) is None
+
+
+def test_average_needs_a_target(query):
+    result = query.answer("average price of cheddar")
+    assert result["intent"] == "aggregate"
+
+
+@pytest.mark.parametrize("question", [
+    "Who is the president of France",
+    "who is the packer",
+    "stella by starlight",
+])
+def test_common_word_brands_need_capitals_or_a_cue(question):
+    parser = QueryParser.from_catalog(CATALOG)
+    assert parser.parse(question) == (None, 0.3)
+
+
+@pytest.mark.parametrize("question", ["brie by president", "president brand brie", "President brie"])
+def test_cued_or_capitalized_brand_is_a_filter(question):
+    parser = QueryParser.from_catalog(CATALOG)
+    assert parser.parse(question) == ({"company_name": {"$eq": "President"}}, 1.0)
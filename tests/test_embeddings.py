@@ -0,0 +1,14 @@
+import numpy as np
+
+from embeddings import EmbeddingCache
+
+
+def test_hot_tier_stores_float32_and_evicts_over_max(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "emb.sqlite3"), max_rows=10, hot_size=4)
+    cache.put_many("m", [f"text {i}" for i in range(10)], [[float(i)] * 3 for i in range(10)])
+    assert cache.rows == 10
+    assert all(isinstance(v, np.ndarray) and v.dtype == np.float32 for v in cache.hot.values())
+
+    cache.put_many("m", ["text 10"], [[10.0] * 3])
+    assert cache.rows == 9
+    assert cache.get_many("m", ["text 0", "text 10"]) == [None, [10.0] * 3]
@@ -0,0 +1,15 @@
+from lexical_index import product_key, reciprocal_rank_fusion
+
+
+def test_float_and_int_skus_share_a_key():
+    assert product_key({"SKU": 124254.0}) == product_key({"SKU": 124254}) == "124254"
+
+
+def test_fusion_merges_a_float_sku_dense_hit_with_an_int_sku_lexical_hit():
+    # Pinecone returns numeric metadata as floats; the lexical index keeps the catalog's ints
+    dense = [{"SKU": 124254.0, "product_name": "Brie"}, {"SKU": 111111.0, "product_name": "Feta"}]
+    lexical = [{"SKU": 222222, "product_name": "Gouda"}, {"SKU": 124254, "product_name": "Brie"}]
+
+    fused = reciprocal_rank_fusion([dense, lexical], top_k=5)
+
+    assert [product_key(product) for product in fused] == ["124254", "222222", "111111"]
@@ -0,0 +1,15 @@
+from product_cards import render_cards
+
+
+def test_cards_show_float_codes_as_integers():
+    markdown = render_cards([{"product_name": "Brie", "SKU": 124254.0, "UPC": 71234500001.0}])
+
+    assert "**SKU:** 124254 " in markdown
+    assert "**UPC:** 71234500001" in markdown
+    assert ".0" not in markdown
+
+
+def test_upc_equal_to_sku_is_not_repeated():
+    markdown = render_cards([{"product_name": "Brie", "SKU": 124254.0, "UPC": 124254}])
+
+    assert "UPC" not in markdown
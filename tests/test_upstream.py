@@ -0,0 +1,60 @@
+import asyncio
+import pytest
+from upstream import Upstream
+
+
+def half_open_upstream():
+    upstream = Upstream("test", rpm=10_000, tpm=10_000_000, max_attempts=1)
+    upstream.breaker.threshold = 1
+    upstream.breaker.cooldown = 0
+    upstream.breaker.record_failure()
+    assert upstream.breaker.state == "open"
+    return upstream
+
+
+def test_cancelled_probe_does_not_wedge_the_breaker():
+    async def scenario():
+        upstream = half_open_upstream()
+        started = asyncio.Event()
+
+        async def hang():
+            started.set()
+            await asyncio.sleep(3600)
+
+        probe = asyncio.ensure_future(upstream.call(hang))
+        await started.wait()
+        assert upstream.breaker.state == "half_open" and upstream.breaker.probing
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert not upstream.breaker.probing
+
+        async def ok():
+            return "ok"
+
+        assert await upstream.call(ok) == "ok"
+        assert upstream.breaker.state == "closed"
+
+    asyncio.run(scenario())
+
+
+def test_only_one_probe_while_half_open():
+    async def scenario():
+        upstream = half_open_upstream()
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def slow():
+            started.set()
+            await release.wait()
+            return "ok"
+
+        probe = asyncio.ensure_future(upstream.call(slow))
+        await started.wait()
+        with pytest.raises(Exception, match="unavailable"):
+            await upstream.call(slow)
+        release.set()
+        assert await probe == "ok"
+        assert upstream.breaker.state == "closed"
+
+    asyncio.run(scenario())
@@ -1,5 +1,5 @@
 @echo off
 echo Starting daily update...
-python scraper.py
+python scraper.py --incremental
 python ingest.py
 python chatbot.py
\ No newline at end of file
@@ -0,0 +1,267 @@
+import os
+import time
+import asyncio
+import email.utils
+import openai
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from rate_limiter import RateLimiter
+import telemetry
+
+# Attempts per upstream call (first try included) and the jittered exponential backoff between them
+UPSTREAM_MAX_ATTEMPTS = int(os.getenv("UPSTREAM_MAX_ATTEMPTS", "4"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "0.5"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "10"))
+# Seconds one attempt may take before it is abandoned and retried
+UPSTREAM_ATTEMPT_TIMEOUT = float(os.getenv("UPSTREAM_ATTEMPT_TIMEOUT", "30"))
+# Requests in flight per upstream, and client-side request/token rates per minute
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "8"))
+EMBED_RPM = int(os.getenv("EMBED_RPM", "3000"))
+EMBED_TPM = int(os.getenv("EMBED_TPM", "1000000"))
+CHAT_RPM = int(os.getenv("CHAT_RPM", "500"))
+CHAT_TPM = int(os.getenv("CHAT_TPM", "30000"))
+# Consecutive failed attempts that open the circuit, and seconds before it lets a probe through
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+
+class UpstreamUnavailable(Exception):
+    """An upstream call failed after all retries, or was refused by an open circuit."""
+
+
+class CircuitOpen(UpstreamUnavailable):
+    pass
+
+
+def is_transient(exc):
+    """Errors worth retrying: rate limits, timeouts, dropped connections and 5xx responses."""
+    if isinstance(exc, (openai.RateLimitError, openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    return status is not None and (status >= 500 or status in (408, 409, 429))
+
+
+def retry_after(exc):
+    """Seconds the server asked us to wait (Retry-After / retry-after-ms), or None."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Closed -> open after `threshold` consecutive failures -> half-open after `cooldown`.
+
+    While open every call is refused at once. Half-open lets a single probe
+    through; its success closes the circuit and its failure reopens it.
+    """
+
+    def __init__(self, name, threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.state = state
+            telemetry.count("circuit_transitions_total", service=self.name, state=state)
+            print(f"Circuit for {self.name} is now {state}")
+
+    def before_call(self):
+        """Refuse the call if the circuit is open; returns True if this call is the half-open probe."""
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self._set_state("half_open")
+        if self.state == "open" or (self.state == "half_open" and self.probing):
+            telemetry.count("upstream_rejected_total", service=self.name)
+            raise CircuitOpen(f"{self.name} is unavailable; retrying in at most {self.cooldown:.0f}s")
+        if self.state == "half_open":
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.probing = False
+        self._set_state("closed")
+
+    def record_failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == "half_open" or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            self._set_state("open")
+
+
+class _Broadcast:
+    """One upstream stream replayed to every subscriber, including late joiners."""
+
+    def __init__(self):
+        self.items = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self.changed = asyncio.Event()
+        self.task = None
+
+    def _notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    async def run(self, source):
+        try:
+            async for item in source:
+                self.items.append(item)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def subscribe(self):
+        position = 0
+        while True:
+            if position < len(self.items):
+                position += 1
+                yield self.items[position - 1]
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self.changed.wait()
+
+
+class Upstream:
+    """Calls to one upstream API (embeddings, chat) with the shared protections.
+
+    Identical in-flight calls (same key) are coalesced into one request.
+    Each attempt waits for a concurrency slot and the client-side rate
+    limit, is bounded by UPSTREAM_ATTEMPT_TIMEOUT and guarded by a circuit
+    breaker. Transient failures are retried with jittered exponential
+    backoff, or after Retry-After when the server sends one. Use from a
+    single event loop.
+    """
+
+    def __init__(self, name, rpm, tpm, concurrency=UPSTREAM_CONCURRENCY, max_attempts=UPSTREAM_MAX_ATTEMPTS):
+        self.name = name
+        self.limiter = RateLimiter(rpm=rpm, tpm=tpm)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.breaker = CircuitBreaker(name)
+        self._semaphore = None
+        self._calls = {}
+        self._streams = {}
+        self._backoff = wait_random_exponential(multiplier=UPSTREAM_BACKOFF_BASE, max=UPSTREAM_BACKOFF_MAX)
+
+    def _wait(self, retry_state):
+        requested = retry_after(retry_state.outcome.exception())
+        if requested is not None:
+            return min(requested, UPSTREAM_BACKOFF_MAX)
+        return self._backoff(retry_state)
+
+    def _before_sleep(self, retry_state):
+        exc = retry_state.outcome.exception()
+        telemetry.count("upstream_retries_total", service=self.name, error=type(exc).__name__)
+        print(f"{self.name} call failed ({type(exc).__name__}); retry {retry_state.attempt_number} "
+              f"in {retry_state.next_action.sleep:.1f}s")
+
+    async def _attempt(self, send, tokens):
+        probe = self.breaker.before_call()
+        if self._semaphore is None:
+            # Created lazily so it binds to the loop the engine runs on
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            async with self._semaphore:
+                await self.limiter.acquire_async(tokens)
+                result = await asyncio.wait_for(send(), UPSTREAM_ATTEMPT_TIMEOUT)
+        except Exception as e:
+            if is_transient(e):
+                self.breaker.record_failure()
+            raise
+        finally:
+            if probe:
+                # A bad request or a cancelled call (turn deadline, client gone) says
+                # nothing about the upstream; release the probe so another call can try
+                self.breaker.probing = False
+        self.breaker.record_success()
+        return result
+
+    async def _call(self, send, tokens):
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(self.max_attempts),
+            wait=self._wait,
+            retry=retry_if_exception(is_transient),
+            before_sleep=self._before_sleep,
+            reraise=True,
+        )
+        try:
+            async for attempt in retrying:
+                with attempt:
+                    return await self._attempt(send, tokens)
+        except Exception as e:
+            if is_transient(e):
+                raise UpstreamUnavailable(f"{self.name} failed after {self.max_attempts} attempts: {e}") from e
+            raise
+
+    async def call(self, send, key=None, tokens=0):
+        """Await send() with retries and limits; callers passing the same key share one call."""
+        if key is None:
+            return await self._call(send, tokens)
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._call(send, tokens))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(self._calls, key, done))
+        else:
+            telemetry.count("upstream_coalesced_total", service=self.name)
+        # Shielded so one caller giving up does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _forget(flights, key, done):
+        if flights.get(key) is done:
+            del flights[key]
+        if not done.cancelled():
+            done.exception()  # retrieved here so an unawaited failure is not logged as lost
+
+    async def stream(self, open_stream, key):
+        """Iterate open_stream() (an async iterator); callers with the same key share one stream.
+
+        open_stream should make its opening request through call() to get
+        retries and limits. The stream stops when its last subscriber leaves.
+        """
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.ensure_future(broadcast.run(open_stream()))
+            broadcast.task.add_done_callback(lambda done: self._streams.pop(key, None)
+                                             if self._streams.get(key) is broadcast else None)
+        else:
+            telemetry.count("upstream_coalesced_total", service=self.name)
+        broadcast.subscribers += 1
+        try:
+            async for item in broadcast.subscribe():
+                yield item
+        finally:
+            broadcast.subscribers -= 1
+            if not broadcast.subscribers and not broadcast.done:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+                broadcast.task.cancel()